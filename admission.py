@@ -0,0 +1,323 @@
+"""
+Admission control in front of the routes and the AllAnime upstream.
+
+Each client IP gets a token bucket; a request that finds it empty is
+answered 429 with Retry-After. Calls to AllAnime draw from one budget
+per worker. When the budget is spent, callers queue by lane, and a
+queued interactive call (stream links, playback) always goes before
+browse traffic (catalog, search, meta), which goes before background
+work (prefetch, crawls, airing polls). A call that would wait longer
+than UPSTREAM_MAX_WAIT fails with Overloaded.
+"""
+import asyncio
+import contextvars
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import g, request
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import metrics
+import telemetry  # noqa: F401  its hooks must run first so rejected requests are measured
+from flask_app import app
+
+# --- Configuration ---
+# Requests per second per client IP, and how many it may send at once; 0 disables
+CLIENT_RATE = float(os.environ.get("ANI_CLIENT_RATE", "10"))
+CLIENT_BURST = float(os.environ.get("ANI_CLIENT_BURST", "60"))
+MAX_CLIENTS = int(os.environ.get("ANI_CLIENT_MAX_TRACKED", "10000"))
+# Upstream requests per second per worker, and the burst allowed; 0 disables
+UPSTREAM_RATE = float(os.environ.get("ANI_UPSTREAM_RATE", "25"))
+UPSTREAM_BURST = float(os.environ.get("ANI_UPSTREAM_BURST", "50"))
+UPSTREAM_MAX_WAIT = float(os.environ.get("ANI_UPSTREAM_MAX_WAIT", "5"))
+UPSTREAM_MAX_QUEUE = int(os.environ.get("ANI_UPSTREAM_MAX_QUEUE", "200"))
+# Reverse proxies in front of the app whose X-Forwarded-* headers are
+# believed. Leave at 0 unless every request passes through them, or
+# clients can pick their own rate-limit key.
+TRUSTED_PROXIES = int(os.environ.get("ANI_TRUSTED_PROXIES", "0"))
+
+# Most urgent first
+LANES = ("interactive", "browse", "background")
+# Routes a viewer is actively waiting on; other routes are browse
+INTERACTIVE_ROUTES = {
+    "/stream/<type_>/<id>.json",
+    "/api/anime/episode/play",
+    "/anime/<anime_name>/<anime_id>/episode/<ep_number>/play",
+    "/anime/<anime_name>/<anime_id>/episode/<ep_number>/play/dub",
+    "/anime/<anime_name>/<anime_id>/episode_data/<ep_number>/play",
+    "/anime/<anime_name>/<anime_id>/episode_data/<ep_number>/play/dub",
+}
+# Cheap local routes that must answer even under load
+EXEMPT_ROUTES = {"/healthz", "/readyz", "/metrics", "/static/<path:filename>"}
+
+# Threads and tasks outside a request are background work
+_lane = contextvars.ContextVar("lane", default="background")
+
+
+class Overloaded(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+def current_lane():
+    return _lane.get()
+
+
+def set_lane(name):
+    _lane.set(name)
+
+
+@contextmanager
+def lane(name):
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def lane_for_route(rule):
+    return "interactive" if rule in INTERACTIVE_ROUTES else "browse"
+
+
+def more_urgent(a, b):
+    return a if LANES.index(a) <= LANES.index(b) else b
+
+
+def carry(fn):
+    """Wraps fn to run in the caller's lane on another thread."""
+    name = current_lane()
+
+    def run(*args, **kwargs):
+        with lane(name):
+            return fn(*args, **kwargs)
+
+    return run
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now if now is not None else time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        """Takes a token and returns 0, or returns the seconds until one is due."""
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class ClientLimiter:
+    """A token bucket per client key, the least recently seen dropped first."""
+
+    def __init__(self, rate=CLIENT_RATE, burst=CLIENT_BURST, max_clients=MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self.counters = {"allowed": 0, "rejected": 0}
+
+    def check(self, client):
+        """Returns 0 when the request may proceed, else seconds until it may."""
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(self.rate, self.burst, now)
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+            wait = bucket.take(now)
+            self.counters["rejected" if wait else "allowed"] += 1
+        if wait:
+            metrics.client_rejections.inc()
+        return wait
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, clients=len(self._buckets), rate=self.rate, burst=self.burst)
+
+
+class UpstreamBudget:
+    """
+    A token bucket shared by every upstream call of this worker, with a
+    priority queue in front of it: a call may only take a token when no
+    call of a more urgent lane is waiting.
+    """
+
+    def __init__(self, rate=UPSTREAM_RATE, burst=UPSTREAM_BURST, max_wait=UPSTREAM_MAX_WAIT,
+                 max_queue=UPSTREAM_MAX_QUEUE):
+        self.rate = rate
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self._bucket = TokenBucket(rate, burst)
+        self._cond = threading.Condition()
+        self._waiting = dict.fromkeys(LANES, 0)
+        self.counters = {
+            name: {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0} for name in LANES
+        }
+
+    def _take(self, name, queued):
+        # Same-lane waiters go first unless this call is one of them
+        ahead = LANES[: LANES.index(name) + (0 if queued else 1)]
+        if any(self._waiting[other] for other in ahead):
+            return max(1 / self.rate, 0.001)
+        return self._bucket.take(time.monotonic())
+
+    def _count(self, name, outcome):
+        self.counters[name][outcome] += 1
+        metrics.upstream_admissions.inc(lane=name, outcome=outcome)
+
+    def _enqueue(self, name):
+        if self._waiting[name] >= self.max_queue:
+            self._count(name, "rejected")
+            raise Overloaded(f"upstream queue full ({name})", self.retry_after())
+        self._waiting[name] += 1
+        self._count(name, "queued")
+        return time.monotonic()
+
+    def _dequeue(self, name, since):
+        self._waiting[name] -= 1
+        self._cond.notify_all()
+        metrics.upstream_queue_seconds.observe(time.monotonic() - since, lane=name)
+
+    def _timed_out(self, name):
+        self._count(name, "timed_out")
+        return Overloaded(f"upstream budget exhausted ({name})", self.retry_after())
+
+    def retry_after(self):
+        queued = sum(self._waiting.values())
+        return max(1, math.ceil((queued + 1) / self.rate))
+
+    def acquire(self, name=None):
+        """Blocks until this call may go upstream; raises Overloaded if it can't soon."""
+        if self.rate <= 0:
+            return
+        name = name or current_lane()
+        with self._cond:
+            if self._take(name, queued=False) == 0:
+                self._count(name, "admitted")
+                return
+            since = self._enqueue(name)
+            deadline = since + self.max_wait
+            try:
+                while True:
+                    wait = self._take(name, queued=True)
+                    if wait == 0:
+                        self._count(name, "admitted")
+                        return
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._timed_out(name)
+                    self._cond.wait(min(wait, remaining))
+            finally:
+                self._dequeue(name, since)
+
+    async def acquire_async(self, name=None):
+        """acquire() for coroutines: waits by sleeping instead of blocking the loop."""
+        if self.rate <= 0:
+            return
+        name = name or current_lane()
+        with self._cond:
+            if self._take(name, queued=False) == 0:
+                self._count(name, "admitted")
+                return
+            since = self._enqueue(name)
+        deadline = since + self.max_wait
+        try:
+            while True:
+                with self._cond:
+                    wait = self._take(name, queued=True)
+                    if wait == 0:
+                        self._count(name, "admitted")
+                        return
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._timed_out(name)
+                await asyncio.sleep(min(wait, remaining))
+        finally:
+            with self._cond:
+                self._dequeue(name, since)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "rate": self.rate,
+                "tokens": round(self._bucket.tokens, 2),
+                "waiting": dict(self._waiting),
+                "lanes": {name: dict(c) for name, c in self.counters.items()},
+            }
+
+
+clients = ClientLimiter()
+budget = UpstreamBudget()
+
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(
+        app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES, x_host=TRUSTED_PROXIES
+    )
+
+
+def forwarded(value, trusted=TRUSTED_PROXIES):
+    """The X-Forwarded-* entry the outermost trusted proxy added, as ProxyFix reads it."""
+    if not trusted or not value:
+        return None
+    values = value.split(",")
+    return values[-trusted].strip() if len(values) >= trusted else None
+
+
+def client_address():
+    return request.remote_addr or "unknown"
+
+
+def too_many_requests(retry_after):
+    response = app.response_class(
+        '{"error": "Too many requests."}\n', status=429, mimetype="application/json"
+    )
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+@app.before_request
+def _admit():
+    rule = request.url_rule.rule if request.url_rule is not None else None
+    if rule in EXEMPT_ROUTES:
+        return None
+    set_lane(lane_for_route(rule))
+    wait = clients.check(client_address())
+    if wait:
+        return too_many_requests(wait)
+    return None
+
+
+@app.after_request
+def _add_retry_after(response):
+    retry_after = g.pop("retry_after", None)
+    if retry_after is not None and response.status_code in (429, 503):
+        response.headers.setdefault("Retry-After", str(retry_after))
+    return response
+
+
+def note_overload(error):
+    """Remembers an Overloaded error so a 503 response can carry Retry-After."""
+    try:
+        g.retry_after = error.retry_after
+    except RuntimeError:
+        pass  # outside a request
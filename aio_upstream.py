@@ -0,0 +1,184 @@
+"""
+asyncio counterpart of upstream.py for the ASGI entry point (asgi.py).
+
+Same retries, circuit breakers, metrics and request coalescing as the
+sync client, but one event loop keeps any number of requests in flight
+instead of one per thread. Needs the optional aiohttp package.
+"""
+import asyncio
+import json
+import os
+import time
+
+import aiohttp
+
+import admission
+import metrics
+import singleflight
+import upstream
+from upstream import API_URL, HEADERS, RETRY_STATUSES, IDEMPOTENT_METHODS
+
+# --- Configuration ---
+# Connections per event loop; a thread-per-request pool needs far fewer
+ASYNC_CONNECTIONS = int(os.environ.get("ANI_ASYNC_CONNECTIONS", "256"))
+ASYNC_CONNECTIONS_PER_HOST = int(os.environ.get("ANI_ASYNC_CONNECTIONS_PER_HOST", "64"))
+
+
+class Response:
+    """The parts of a requests.Response the app reads, with the body already read."""
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise upstream.UpstreamError(self.status_code)
+
+
+class AsyncClient:
+    def __init__(self):
+        self._sessions = {}  # event loop -> ClientSession
+        self._inflight = {}  # (loop, key) -> Future
+        self.coalesced = {"leaders": 0, "followers": 0}
+
+    def session(self):
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=ASYNC_CONNECTIONS, limit_per_host=ASYNC_CONNECTIONS_PER_HOST
+            )
+            timeout = aiohttp.ClientTimeout(
+                sock_connect=upstream.CONNECT_TIMEOUT, sock_read=upstream.READ_TIMEOUT
+            )
+            session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=HEADERS)
+            self._sessions[loop] = session
+        return session
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        session = self._sessions.pop(loop, None)
+        if session is not None:
+            await session.close()
+
+    async def request(self, method, url, operation, idempotent=None, **kwargs):
+        """Same contract as upstream.request, but awaitable."""
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        attempts = 1 + (upstream.MAX_RETRIES if idempotent else 0)
+        breaker = upstream.breaker_for(url)
+        host = breaker.name
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            if not breaker.allow():
+                raise upstream.CircuitOpenError(breaker.name)
+            if host in upstream.BUDGET_HOSTS:
+                try:
+                    await admission.budget.acquire_async()
+                except admission.Overloaded as e:
+                    breaker.release()
+                    raise upstream.OverloadedError(e) from e
+                except asyncio.CancelledError:
+                    breaker.release()
+                    raise
+            start = time.monotonic()
+            metrics.upstream_in_flight.inc(operation=operation)
+            try:
+                async with self.session().request(method, url, **kwargs) as res:
+                    response = Response(res.status, res.headers, await res.read())
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                upstream._observe(operation, host, time.monotonic() - start, "error")
+                breaker.failure()
+                if last_attempt:
+                    raise
+            except BaseException:
+                # Cancelled, e.g. the losing side of a hedge: it says nothing
+                # about the host, but the gauge and a trial slot must come back
+                metrics.upstream_in_flight.dec(operation=operation)
+                breaker.release()
+                raise
+            else:
+                upstream._observe(operation, host, time.monotonic() - start, response.status_code)
+                if response.status_code in RETRY_STATUSES:
+                    breaker.failure()
+                else:
+                    breaker.success()
+                if response.status_code not in RETRY_STATUSES or last_attempt:
+                    return response
+            upstream.latency.record_retry(operation)
+            await asyncio.sleep(upstream._backoff(attempt))
+
+    async def coalesce(self, key, fn):
+        """Awaiters of the same key on one loop share a single call of fn."""
+        slot = (asyncio.get_running_loop(), key)
+        task = self._inflight.get(slot)
+        if task is not None:
+            self.coalesced["followers"] += 1
+        else:
+            # Its own task, so a cancelled awaiter doesn't cancel it for the rest
+            task = self._inflight[slot] = asyncio.ensure_future(fn())
+            self.coalesced["leaders"] += 1
+
+            def finished(task):
+                del self._inflight[slot]
+                if not task.cancelled():
+                    task.exception()  # every awaiter may be gone; don't warn about it
+
+            task.add_done_callback(finished)
+        return await asyncio.shield(task)
+
+    async def hedged(self, operation, fn):
+        """Like upstream.hedged: a second attempt once the first passes p95."""
+        delay = max(
+            upstream.latency.p95(operation) or upstream.HEDGE_DEFAULT_DELAY,
+            upstream.HEDGE_MIN_DELAY,
+        )
+        first = asyncio.ensure_future(fn())
+        done, _pending = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+        second = asyncio.ensure_future(fn())
+        upstream.count_hedge(operation, "hedged")
+        pending = {first, second}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if task is second:
+                        upstream.count_hedge(operation, "hedge_wins")
+                    return task.result()
+        return first.result()
+
+    async def graphql(self, query, variables, operation, hedge=False):
+        payload = {"query": query, "variables": variables}
+
+        def call():
+            return self.request("POST", API_URL, operation, idempotent=True, json=payload)
+
+        if hedge and upstream.HEDGE_ENABLED:
+            fn = lambda: self.hedged(operation, call)  # noqa: E731
+        else:
+            fn = call
+        return await self.coalesce(singleflight.graphql_key(query, variables), fn)
+
+    async def get(self, url, operation="provider", **kwargs):
+        return await self.request("GET", url, operation, **kwargs)
+
+    def stats(self):
+        return dict(self.coalesced, inflight=len(self._inflight), loops=len(self._sessions))
+
+
+client = AsyncClient()
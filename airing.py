@@ -0,0 +1,286 @@
+"""
+New-episode tracking shared by every worker process.
+
+Tracked shows and the event feed live in SQLite, so a show tracked through
+one worker is polled once, and every worker serves the same feed with the
+same event ids. Only the worker holding the poll lease fetches from
+upstream; another takes over if it stops renewing.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+import batch
+import history
+import sqlite_local
+
+# --- Configuration ---
+# A show is polled this often right after it gains an episode...
+MIN_INTERVAL = int(os.environ.get("ANI_AIRING_MIN_INTERVAL", "600"))
+# ...and backs off by BACKOFF per quiet poll up to this
+MAX_INTERVAL = int(os.environ.get("ANI_AIRING_MAX_INTERVAL", str(6 * 3600)))
+BACKOFF = 1.5
+# How often the scheduler looks for shows that are due
+TICK_INTERVAL = int(os.environ.get("ANI_AIRING_TICK", "60"))
+MAX_TRACKED = int(os.environ.get("ANI_AIRING_MAX_SHOWS", "2000"))
+FEED_SIZE = 500
+LANGS = ("sub", "dub")
+# Shared with the watch history unless set
+AIRING_DB_PATH = os.environ.get("ANI_AIRING_DB", history.HISTORY_DB_PATH)
+# A poller that hasn't renewed its lease for this long is presumed gone
+LEASE_SECONDS = 3 * TICK_INTERVAL
+# How often a waiting reader checks for events published by other workers
+WAIT_CHECK = float(os.environ.get("ANI_AIRING_WAIT_CHECK", "2"))
+
+
+def fetch_fresh(anime_ids):
+    """Uncached show lookups, sent as parallel aliased batches."""
+    return dict(zip(anime_ids, batch.show_loader.load_many(anime_ids)))
+
+
+def episode_order(ep):
+    try:
+        return float(ep)
+    except ValueError:
+        return float("inf")
+
+
+class AiringTracker:
+    """
+    Polls tracked shows on a per-show adaptive interval, several per
+    batched upstream request, and turns episode-list changes into a feed
+    of new-episode events that readers can page through or wait on.
+    """
+
+    def __init__(self, fetch=fetch_fresh, path=AIRING_DB_PATH):
+        self.fetch = fetch
+        self.path = path
+        self._connections = sqlite_local.LocalConnections(path, row_factory=sqlite3.Row)
+        self._ready = False
+        self._init_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._polling = threading.Lock()
+        self.counters = {"polls": 0, "shows_polled": 0, "changes": 0, "errors": 0}
+
+    def _connect(self):
+        conn = self._connections.get()
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    self._create(conn)
+                    self._ready = True
+        return conn
+
+    def _create(self, conn):
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS airing_shows (
+                anime_id TEXT PRIMARY KEY,
+                name TEXT NOT NULL DEFAULT '',
+                episodes TEXT,
+                interval REAL NOT NULL,
+                next_poll REAL NOT NULL,
+                last_change REAL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS airing_due ON airing_shows (next_poll)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS airing_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                anime_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                lang TEXT NOT NULL,
+                episodes TEXT NOT NULL,
+                ts REAL NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS airing_lease (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires REAL NOT NULL
+            )
+            """
+        )
+
+    def track(self, anime_ids):
+        now = time.time()
+        added = 0
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            tracked = conn.execute("SELECT COUNT(*) FROM airing_shows").fetchone()[0]
+            for anime_id in dict.fromkeys(anime_ids):
+                if not anime_id or tracked >= MAX_TRACKED:
+                    continue
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO airing_shows (anime_id, interval, next_poll)"
+                    " VALUES (?, ?, ?)",
+                    (anime_id, MIN_INTERVAL, now),
+                )
+                added += cursor.rowcount
+                tracked += cursor.rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return added
+
+    def untrack(self, anime_id):
+        cursor = self._connect().execute(
+            "DELETE FROM airing_shows WHERE anime_id = ?", (anime_id,)
+        )
+        return cursor.rowcount > 0
+
+    def _take_lease(self, now):
+        """True when this worker holds the poll lease, renewing it."""
+        holder = f"{socket.gethostname()}:{os.getpid()}"
+        cursor = self._connect().execute(
+            """
+            INSERT INTO airing_lease (name, holder, expires) VALUES ('poll', ?, ?)
+            ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires = excluded.expires
+            WHERE airing_lease.holder = excluded.holder OR airing_lease.expires < ?
+            """,
+            (holder, now + LEASE_SECONDS, now),
+        )
+        return cursor.rowcount > 0
+
+    def poll_due(self, now=None):
+        """Polls every show that is due; returns the fetched shows by id."""
+        # One poll at a time, or overlapping polls fetch the same shows
+        if not self._polling.acquire(blocking=False):
+            return {}
+        try:
+            now = now or time.time()
+            if not self._take_lease(now):
+                return {}
+            return self._poll(now)
+        finally:
+            self._polling.release()
+
+    def _poll(self, now):
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT * FROM airing_shows WHERE next_poll <= ?", (now,)
+        ).fetchall()
+        if not rows:
+            return {}
+        due = [row["anime_id"] for row in rows]
+        try:
+            shows = self.fetch(due)
+        except Exception:
+            self._count("errors")
+            conn.executemany(
+                "UPDATE airing_shows SET next_poll = ? WHERE anime_id = ?",
+                [(now + MIN_INTERVAL, anime_id) for anime_id in due],
+            )
+            return {}
+        self._count("polls")
+        self._count("shows_polled", len(due))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for row in rows:
+                self._update(conn, row, shows.get(row["anime_id"]) or {}, now)
+            conn.execute(
+                "DELETE FROM airing_events WHERE id <= (SELECT MAX(id) FROM airing_events) - ?",
+                (FEED_SIZE,),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        with self._cond:
+            self._cond.notify_all()
+        return {anime_id: show for anime_id, show in shows.items() if show}
+
+    def _update(self, conn, row, show, now):
+        anime_id = row["anime_id"]
+        if not show:
+            # Unknown or failed lookup: keep the snapshot, try again later
+            interval = min(row["interval"] * BACKOFF, MAX_INTERVAL)
+            conn.execute(
+                "UPDATE airing_shows SET interval = ?, next_poll = ? WHERE anime_id = ?",
+                (interval, now + interval, anime_id),
+            )
+            return
+        detail = show.get("availableEpisodesDetail") or {}
+        episodes = {lang: sorted(detail.get(lang) or ()) for lang in LANGS}
+        name = show.get("name") or row["name"]
+        changed = False
+        if row["episodes"] is not None:
+            known = json.loads(row["episodes"])
+            for lang in LANGS:
+                new = set(episodes[lang]) - set(known.get(lang) or ())
+                if new:
+                    changed = True
+                    self._publish(conn, anime_id, name, lang, new, now)
+        if changed:
+            interval, last_change = MIN_INTERVAL, now
+        else:
+            interval, last_change = min(row["interval"] * BACKOFF, MAX_INTERVAL), row["last_change"]
+        conn.execute(
+            "UPDATE airing_shows SET name = ?, episodes = ?, interval = ?, next_poll = ?,"
+            " last_change = ? WHERE anime_id = ?",
+            (name, json.dumps(episodes), interval, now + interval, last_change, anime_id),
+        )
+
+    def _publish(self, conn, anime_id, name, lang, episodes, now):
+        conn.execute(
+            "INSERT INTO airing_events (anime_id, name, lang, episodes, ts) VALUES (?, ?, ?, ?, ?)",
+            (anime_id, name, lang, json.dumps(sorted(episodes, key=episode_order)), now),
+        )
+        self._count("changes")
+
+    def _count(self, name, n=1):
+        with self._cond:
+            self.counters[name] += n
+
+    def events(self, since=0, limit=100):
+        rows = self._connect().execute(
+            "SELECT * FROM airing_events WHERE id > ? ORDER BY id LIMIT ?", (since, limit)
+        ).fetchall()
+        return [dict(row, episodes=json.loads(row["episodes"])) for row in rows]
+
+    def last_event(self):
+        row = self._connect().execute("SELECT MAX(id) FROM airing_events").fetchone()
+        return row[0] or 0
+
+    def wait(self, since, timeout):
+        """Blocks until there are events after since or timeout passes."""
+        end = time.monotonic() + timeout
+        while True:
+            events = self.events(since)
+            remaining = end - time.monotonic()
+            if events or remaining <= 0:
+                return events
+            # Woken early by a poll in this worker; other workers' events
+            # show up at the next check
+            with self._cond:
+                self._cond.wait(min(remaining, WAIT_CHECK))
+
+    def stats(self):
+        conn = self._connect()
+        shows = conn.execute(
+            "SELECT COUNT(*), SUM(next_poll <= ?) FROM airing_shows", (time.time(),)
+        ).fetchone()
+        lease = conn.execute("SELECT holder, expires FROM airing_lease WHERE name = 'poll'").fetchone()
+        with self._cond:
+            counters = dict(self.counters)
+        return dict(
+            counters,
+            tracked=shows[0],
+            due=shows[1] or 0,
+            last_event=self.last_event(),
+            poller=lease["holder"] if lease and lease["expires"] >= time.time() else None,
+        )
+
+
+tracker = AiringTracker()
@@ -1,14 +1,65 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
 import requests
 import urllib.parse
+import admission
+import airing
+import batch
+import cache
+import decoder
+import history
+import http_cache  # noqa: F401  registers the ETag, Cache-Control and compression hooks
+import metrics
+import posters
+import prefetch
+import profiler
+import proxy
+import show_index
+import singleflight
+import source_health
+import telemetry  # noqa: F401  registers the request logging and metrics hooks
+import upstream
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from flask import Response
 from flask_app import *
 
-API_URL = "https://api.allanime.day/api"
-
-HEADERS = {
-    "Referer": "https://allanime.to",
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/121.0",
-    "Content-Type": "application/json",
-}
+# Overall time budget for the provider fan-out of one episode
+SOURCE_DEADLINE = float(os.environ.get("ANI_SOURCE_DEADLINE", "8"))
+PROVIDER_WORKERS = int(os.environ.get("ANI_PROVIDER_WORKERS", "16"))
+# priority() class that ends a "first good link wins" resolution early
+TOP_PRIORITY = 0
+QUALITY_IN_URL = re.compile(r"(?<!\d)(2160|1440|1080|720|480|360)p", re.IGNORECASE)
+
+provider_executor = ThreadPoolExecutor(
+    max_workers=PROVIDER_WORKERS, thread_name_prefix="provider"
+)
+
+# Shows per upstream search page
+SEARCH_PAGE_SIZE = 40
+# Most ids one /api/anime/batch call may ask for
+MAX_BATCH_IDS = 200
+
+# Show details change rarely; signed stream links expire within minutes
+search_cache = cache.create("search", ttl=600, stale_ttl=3600)
+show_cache = cache.create("show", ttl=3600, stale_ttl=6 * 3600)
+# Stale links are only served while AllAnime is failing
+sources_cache = cache.create("sources", ttl=300, stale_ttl=1800)
+# Quality the provider reported for a link ("1080p"), kept as long as its referer
+link_quality_cache = cache.create("link_quality", ttl=6 * 3600, max_bytes=4 * 1024 * 1024)
+
+# Concurrent requests for the same episode share a single provider fan-out
+sources_inflight = singleflight.Group("sources")
+
+# Next-episode warm-up: start shortly after episode N is served, refresh the
+# links a minute before the sources cache drops them, for about two episodes
+NEXT_EPISODE_DELAY = 5
+NEXT_EPISODE_REFRESH = sources_cache.ttl - 60
+NEXT_EPISODE_KEEP = 50 * 60
+PREFETCH_DUB = os.environ.get("ANI_PREFETCH_DUB", "0") == "1"
 
 GRAPHQL_SEARCH_QUERY = """
 query(
@@ -34,6 +85,19 @@ query(
 }
 """
 
+GRAPHQL_SOURCES_QUERY = """
+query ($showId: String!, $translationType: VaildTranslationTypeEnumType!, $episodeString: String!) {
+  episode(
+    showId: $showId
+    translationType: $translationType
+    episodeString: $episodeString
+  ) {
+    episodeString
+    sourceUrls
+  }
+}
+"""
+
 GRAPHQL_EPISODE_QUERY = """
 query($showId: String!) {
     episodeList(showId: $showId) {
@@ -53,57 +117,125 @@ def get_shows():
     if not query:
         return {"error": "Please enter a search term."}, 400
 
-    payload = {
-        "query": GRAPHQL_SEARCH_QUERY,
-        "variables": {
-            "search": {"allowAdult": False, "allowUnknown": False, "query": query},
-            "limit": 40,
-            "page": 1,
-            "translationType": "sub",
-            "countryOrigin": "ALL",
-        },
+    # Answer from the local index unless it has nothing fresh for the query
+    shows, fresh = show_index.index.search(query)
+    show_index.index.record(local=fresh)
+    if not fresh:
+        try:
+            shows = search_shows(query)
+        except upstream.UpstreamError as e:
+            return {"error": f"Error: {e.status_code}"}, e.status_code
+    shows = sorted(shows, key=lambda x: x.get("name", "z"))
+
+    return shows, query
+
+
+def search_variables(query, page):
+    return {
+        "search": {"allowAdult": False, "allowUnknown": False, "query": query},
+        "limit": SEARCH_PAGE_SIZE,
+        "page": page,
+        "translationType": "sub",
+        "countryOrigin": "ALL",
     }
 
-    response = requests.post(API_URL, headers=HEADERS, json=payload)
-    if response.status_code != 200:
-        return {"error": f"Error: {response.status_code}"}, response.status_code
 
+def parse_search(response):
+    if response.status_code != 200:
+        raise upstream.UpstreamError(response.status_code)
     data = response.json()
     shows = data.get("data", {}).get("shows", {}).get("edges", [])
-    shows = sorted(shows, key=lambda x: x.get("name", "z"))
+    show_index.index.add_many(shows)
+    return shows
+
+
+def search_shows(query, page=1):
+    variables = search_variables(query, page)
+
+    def load():
+        return parse_search(upstream.graphql(GRAPHQL_SEARCH_QUERY, variables, "search"))
+
+    return search_cache.get_or_load((query, page), load)
+
+
+def crawl_show_index():
+    """Fills the local show index from the first pages of the show listing."""
+    for page in range(1, show_index.CRAWL_PAGES + 1):
+        if not search_shows("", page):
+            break
 
-    return shows, query
+
+def poll_airing():
+    # Everything in someone's watch history is worth following
+    try:
+        airing.tracker.track(history.store().anime_ids())
+    except sqlite3.Error:
+        pass
+    for anime_id, show in airing.tracker.poll_due().items():
+        show_cache.set(anime_id, show)
+
+
+background_started = threading.Event()
+
+
+@app.before_request
+def start_background_jobs():
+    # From the first request rather than at import, so a preloading server
+    # doesn't start these in its master process and fork mid-request
+    if background_started.is_set():
+        return
+    background_started.set()
+    forever = float("inf")
+    if show_index.CRAWL_PAGES:
+        prefetch.prefetcher.schedule(
+            "show_index_crawl",
+            crawl_show_index,
+            refresh_every=show_index.CRAWL_INTERVAL,
+            keep_for=forever,
+        )
+    prefetch.prefetcher.schedule(
+        "airing_poll", poll_airing, refresh_every=airing.TICK_INTERVAL, keep_for=forever
+    )
+
+
+def fetch_show(anime_id):
+    # Concurrent lookups of different shows share one aliased request
+    # An empty show is unknown for now, not for the cache's lifetime
+    return show_cache.get_or_load(
+        anime_id, lambda: batch.show_loader.load(anime_id).result(), keep=bool
+    )
+
+
+def fetch_shows(anime_ids):
+    """Returns {anime_id: show} using the cache, batching every miss."""
+    shows = {}
+    missing = []
+    for anime_id in dict.fromkeys(anime_ids):
+        show = show_cache.get(anime_id)
+        if show is None:
+            missing.append(anime_id)
+        else:
+            shows[anime_id] = show
+    for anime_id, show in zip(missing, batch.show_loader.load_many(missing)):
+        if show:
+            show_cache.set(anime_id, show)
+        shows[anime_id] = show
+    return shows
 
 
 @app.route("/api/search", methods=["GET"])
 def api_search():
     shows, _q = get_shows()
+    if isinstance(shows, dict):
+        return http_cache.uncached({"shows": shows})
     return {"shows": shows}
 
 
 @app.route("/search")
 def search():
     shows, _q = get_shows()
-    # Limit 10 shows for display
-    # shows = shows[:10]
-
-    # Fetch image from OMDb for each show
-    for show in shows:
-        #     title = show.get("name", "")
-        #     omdb_response = requests.get("https://www.omdbapi.com/", params={
-        #         "t": title,
-        #         "apikey": 'bf007c6a'
-        #     })
-        #
-        #     if omdb_response.status_code == 200:
-        #         omdb_data = omdb_response.json()
-        #         poster_url = omdb_data.get("Poster")
-        #         if poster_url and poster_url != "N/A":
-        #             show["poster"] = poster_url
-        #         else:
-        #             show["poster"] = "/static/no-image.png"  # fallback image
-        #     else:
-        show["poster"] = "/static/no-image.png"
+    # Cached posters now, OMDb lookups for the rest in the background
+    shows = posters.enricher.decorate(shows)
 
     return render_template("results.html", shows=shows, query=_q)
 
@@ -112,106 +244,234 @@ def search():
 def anime_episode():
     data = request.json
     anime_id = data["anime_id"]
-    query = """
-        query ($showId: String!) {
-          show(_id: $showId) {
-            _id
-            name
-            availableEpisodesDetail
-          }
-        }
-        """
-
-    payload = {"query": query, "variables": {"showId": anime_id}}
-
-    response = requests.post(API_URL, headers=HEADERS, json=payload)
-    if response.status_code != 200:
+    try:
+        show = fetch_show(anime_id)
+    except upstream.UpstreamError:
         return f"Error loading episodes for ID {anime_id}"
 
-    data = response.json()
-    show = data.get("data", {}).get("show", {})
     name = show.get("name", "Unknown Anime")
     episode_data = show.get("availableEpisodesDetail", {})
     episodes = sorted(episode_data.get("sub", []), key=lambda x: float(x))
     return {"episodes": episodes}
 
 
-def fetch_usable_urls(data):
-    anime_id = data["anime_id"]
-    ep_number = data["ep_number"]
-    lang = data["lang"]
-    query = """
-        query ($showId: String!, $translationType: VaildTranslationTypeEnumType!, $episodeString: String!) {
-          episode(
-            showId: $showId
-            translationType: $translationType
-            episodeString: $episodeString
-          ) {
-            episodeString
-            sourceUrls
-          }
-        }
-        """
-
-    payload = {
-        "query": query,
-        "variables": {
-            "showId": anime_id,
-            "translationType": "sub",
-            "episodeString": ep_number,
-        },
+def fetch_usable_urls(data, deadline=None, first_good=None, use_cache=True):
+    if first_good is None:
+        first_good = data.get("first_good", False)
+    key = (data["anime_id"], str(data["ep_number"]), data["lang"], bool(first_good))
+    return sources_inflight.do(
+        key,
+        lambda: _fetch_usable_urls(
+            data, deadline=deadline, first_good=first_good, use_cache=use_cache
+        ),
+    )
+
+
+def episode_variables(data):
+    """The sources query variables and the sources_cache key for an episode."""
+    variables = {
+        "showId": data["anime_id"],
+        "translationType": "sub",
+        "episodeString": data["ep_number"],
     }
 
-    if payload["variables"]["translationType"] == "sub" and lang == "dub":
-        payload["variables"]["translationType"] = "dub"
+    if variables["translationType"] == "sub" and data["lang"] == "dub":
+        variables["translationType"] = "dub"
+
+    cache_key = (data["anime_id"], str(data["ep_number"]), variables["translationType"])
+    return variables, cache_key
 
-    response = requests.post(API_URL, headers=HEADERS, json=payload)
+
+def provider_urls_from(data):
+    sources = data.get("data", {}).get("episode", {}).get("sourceUrls", [])
+    provider_urls = []
+
+    # remove leading '--' and decode all provider ids in one pass
+    encoded = [
+        src["sourceUrl"][2:]
+        for src in sources
+        if (src.get("sourceUrl") or "").startswith("--")
+    ]
+    for cleaned_url in decoder.decode_many(encoded):
+        cleaned_url = provider_url(cleaned_url)
+        if "apivtwo" in cleaned_url:
+            provider_urls.append(cleaned_url)
+    return provider_urls
+
+
+def store_sources(cache_key):
+    def store(urls):
+        if urls:
+            sources_cache.set(cache_key, urls)
+
+    return store
+
+
+def _fetch_usable_urls(data, deadline, first_good, use_cache):
+    variables, cache_key = episode_variables(data)
+    cached_urls, state = sources_cache.lookup(cache_key)
+    if use_cache and state == cache.FRESH:
+        # Host health may have changed since the links were cached
+        return {"urls": source_health.monitor.rank(cached_urls, priority)}
+
+    try:
+        response = upstream.graphql(GRAPHQL_SOURCES_QUERY, variables, "episode", hedge=True)
+    except (requests.RequestException, upstream.UpstreamError) as e:
+        if cached_urls is not None:
+            urls = source_health.monitor.rank(cached_urls, priority)
+            return {"urls": urls, "stale": state == cache.STALE}
+        return {"urls": [], "error": str(e)}
     if response.status_code != 200:
         return response.json(), response.status_code
 
-    data = response.json()
-    sources = data.get("data", {}).get("episode", {}).get("sourceUrls", [])
-    usable_urls = []
+    usable_urls = resolve_provider_urls(
+        provider_urls_from(response.json()),
+        deadline=deadline,
+        first_good=first_good,
+        on_complete=store_sources(cache_key),
+    )
+    return {"urls": usable_urls}
+
 
-    for src in sources:
-        raw_url = src.get("sourceUrl")
-
-        if raw_url.startswith("--"):
-            cleaned_url = raw_url[2:]  # remove leading '--'
-            cleaned_url = substitute_hex(cleaned_url)
-            if "apivtwo" in cleaned_url:
-                try:
-                    res = requests.get(cleaned_url, headers=HEADERS)
-                    res.raise_for_status()
-                except requests.RequestException:
-                    continue
-                res = res.json()
-                links = res.get("links", [])
-                for link in links:
-                    usable_urls.append(link.get("link"))
-
-    if not usable_urls:
+def priority(link):
+    if not link:
+        return 5
+    if "myanime.sharepoint.com" in link:
+        return 0
+    elif "1080p" in link:
+        return 1
+    elif "720p" in link:
+        return 2
+    elif "480p" in link:
+        return 3
+    else:
+        return 4
+
+
+def rank_links(links):
+    """Orders links by priority() class adjusted for current host health."""
+    source_health.monitor.observe(links)
+    return source_health.monitor.rank(links, priority)
+
+
+def links_from(links):
+    for link in links:
+        proxy.remember_referer(link.get("link"), (link.get("headers") or {}).get("Referer"))
+        if link.get("link") and link.get("resolutionStr"):
+            link_quality_cache.set(link["link"], link["resolutionStr"])
+    return [link.get("link") for link in links if link.get("link")]
+
+
+def link_quality(url):
+    """The provider's quality label for a link, else one found in the URL, else ""."""
+    quality = link_quality_cache.get(url)
+    if quality:
+        return quality
+    match = QUALITY_IN_URL.search(url or "")
+    return match.group(1) + "p" if match else ""
+
+
+def fetch_provider_links(url):
+    try:
+        res = upstream.get(url)
+        res.raise_for_status()
+        links = res.json().get("links", [])
+    except (requests.RequestException, upstream.UpstreamError):
         return []
+    return links_from(links)
 
 
-    def priority(link):
-        if not link:
-            return 5
-        if "myanime.sharepoint.com" in link:
-            return 0
-        elif "1080p" in link:
-            return 1
-        elif "720p" in link:
-            return 2
-        elif "480p" in link:
-            return 3
+def resolve_provider_urls(provider_urls, deadline=None, first_good=False, on_complete=None):
+    """
+    Fetches every provider endpoint concurrently and returns the links that
+    arrived within the deadline, best first. With first_good the call returns
+    as soon as a top-priority link shows up. Fetches still running at that
+    point keep going, and on_complete gets the full sorted list once they end.
+    """
+    if deadline is None:
+        deadline = SOURCE_DEADLINE
+    metrics.provider_fanout.observe(len(provider_urls))
+    futures = [
+        provider_executor.submit(admission.carry(fetch_provider_links), url)
+        for url in provider_urls
+    ]
+    usable_urls = []
+    pending = set(futures)
+    end = time.monotonic() + deadline
+
+    while pending:
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            usable_urls.extend(future.result())
+        if first_good and any(priority(link) == TOP_PRIORITY for link in usable_urls):
+            break
+
+    if on_complete is not None:
+        if pending:
+            _collect_in_background(futures, on_complete)
         else:
-            return 4
-
-    usable_urls = [i for i in usable_urls if i]
-
-    usable_urls = sorted(usable_urls, key=priority)
-    return {"urls": usable_urls}
+            on_complete(rank_links(usable_urls))
+
+    return rank_links(usable_urls)
+
+
+def _collect_in_background(futures, on_complete):
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_future):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        links = [link for future in futures for link in future.result()]
+        on_complete(rank_links(links))
+
+    for future in futures:
+        future.add_done_callback(done)
+
+
+def next_episode(anime_id, ep_number, lang="sub"):
+    try:
+        show = fetch_show(anime_id)
+    except (requests.RequestException, upstream.UpstreamError):
+        return None
+    episodes = (show.get("availableEpisodesDetail") or {}).get(lang, [])
+    later = [ep for ep in episodes if float(ep) > float(ep_number)]
+    return min(later, key=float) if later else None
+
+
+def prefetch_next_episode(anime_id, ep_number, lang="sub"):
+    """Keeps the links of the episode after ep_number warm in sources_cache."""
+
+    def warm(next_ep, next_lang):
+        fetch_usable_urls(
+            {"anime_id": anime_id, "ep_number": next_ep, "lang": next_lang},
+            use_cache=False,
+        )
+
+    def schedule():
+        next_ep = next_episode(anime_id, ep_number, lang)
+        if next_ep is None:
+            return
+        langs = [lang]
+        if PREFETCH_DUB and lang == "sub" and next_episode(anime_id, ep_number, "dub") == next_ep:
+            langs.append("dub")
+        for next_lang in langs:
+            prefetch.prefetcher.schedule(
+                ("sources", anime_id, next_ep, next_lang),
+                lambda next_lang=next_lang: warm(next_ep, next_lang),
+                refresh_every=NEXT_EPISODE_REFRESH,
+                keep_for=NEXT_EPISODE_KEEP,
+            )
+
+    # Looking up the episode list is itself upstream work, so it runs there too
+    prefetch.prefetcher.schedule(
+        ("next", anime_id, str(ep_number), lang), schedule, delay=NEXT_EPISODE_DELAY
+    )
 
 
 @app.route("/anime/<anime_name>/<anime_id>/episode_data/<ep_number>/play/dub")
@@ -222,7 +482,8 @@ def get_ep_data_dub(anime_name, anime_id, ep_number):
 
 def get_episode_data(anime_name, anime_id, ep_number, lang="sub"):
     usable_urls = fetch_usable_urls(
-        data={"anime_id": anime_id, "ep_number": ep_number, "lang": lang}
+        data={"anime_id": anime_id, "ep_number": ep_number, "lang": lang},
+        first_good=True,
     ).get("urls", [])
     selected_source = "No usable URL found"
     if len(usable_urls) > 0:
@@ -252,84 +513,238 @@ def anime_episode_play():
     return fetch_usable_urls(data)
 
 
-@app.route("/anime/<anime_id>")
-def anime_detail(anime_id):
-    query = """
-    query ($showId: String!) {
-      show(_id: $showId) {
-        _id
-        name
-        availableEpisodesDetail
-      }
-    }
-    """
+@app.route("/api/anime/batch", methods=["POST"])
+def anime_batch():
+    data = request.json or {}
+    anime_ids = data.get("anime_ids") or []
+    if not isinstance(anime_ids, list) or not anime_ids:
+        return {"error": "anime_ids must be a non-empty list."}, 400
+    if len(anime_ids) > MAX_BATCH_IDS:
+        return {"error": f"At most {MAX_BATCH_IDS} anime_ids per request."}, 400
+
+    try:
+        shows = fetch_shows(anime_ids)
+    except upstream.UpstreamError as e:
+        return {"error": f"Error: {e.status_code}"}, e.status_code
+
+    result = {}
+    for anime_id, show in shows.items():
+        episode_data = show.get("availableEpisodesDetail") or {}
+        result[anime_id] = {
+            "name": show.get("name", "Unknown Anime"),
+            "episodes": {
+                lang: sorted(episode_data.get(lang, []), key=lambda x: float(x))
+                for lang in ("sub", "dub")
+            },
+        }
+    return {"shows": result}
 
-    payload = {"query": query, "variables": {"showId": anime_id}}
 
-    response = requests.post(API_URL, headers=HEADERS, json=payload)
-    if response.status_code != 200:
-        return f"Error loading episodes for ID {anime_id}"
+def history_user():
+    data = request.get_json(silent=True) or {}
+    return (
+        request.args.get("user")
+        or data.get("user")
+        or request.headers.get("X-User")
+        or history.DEFAULT_USER
+    )
+
+
+def remember_watch(anime_id, ep_number, title=None, lang="sub", user=history.DEFAULT_USER):
+    try:
+        history.store().record(user, anime_id, ep_number, title, lang)
+    except sqlite3.Error:
+        # Playback must not fail because the history file is busy
+        pass
+
+
+@app.route("/api/history", methods=["GET"])
+def history_list():
+    return {"history": history.store().entries(history_user())}
+
+
+@app.route("/api/history", methods=["POST"])
+def history_record():
+    data = request.get_json(silent=True) or {}
+    if not data.get("anime_id") or not data.get("episode"):
+        return {"error": "anime_id and episode are required."}, 400
+    history.store().record(
+        history_user(),
+        data["anime_id"],
+        data["episode"],
+        title=data.get("title"),
+        lang=data.get("lang", "sub"),
+        position=data.get("position"),
+        duration=data.get("duration"),
+    )
+    return {"status": "ok"}
+
+
+@app.route("/api/history/<anime_id>", methods=["DELETE"])
+def history_delete(anime_id):
+    return {"deleted": history.store().delete(history_user(), anime_id)}
+
+
+@app.route("/api/history/import", methods=["POST"])
+def history_import():
+    """Imports an ani-cli ani-hsts file, sent as a "file" upload or the raw body."""
+    upload = request.files.get("file")
+    raw = upload.read() if upload else request.get_data()
+    lines = raw.decode("utf-8", errors="replace").splitlines()
+    return {"imported": history.store().import_hsts(lines, user=history_user())}
+
+
+@app.route("/api/history/continue")
+def history_continue():
+    """Shows in the user's history with an episode after the last one watched."""
+    entries = history.store().entries(history_user(), limit=MAX_BATCH_IDS)
+    try:
+        # Cached shows are answered locally and the rest go out in parallel batches
+        shows = fetch_shows([entry["anime_id"] for entry in entries])
+    except (requests.RequestException, upstream.UpstreamError) as e:
+        return {"error": str(e)}, 502
+
+    result = []
+    for entry in entries:
+        show = shows.get(entry["anime_id"]) or {}
+        available = (show.get("availableEpisodesDetail") or {}).get(entry["lang"], [])
+        next_ep = history.next_episode(available, entry["episode"])
+        if next_ep is None:
+            continue
+        result.append(
+            {
+                "anime_id": entry["anime_id"],
+                "name": show.get("name") or entry["title"],
+                "lang": entry["lang"],
+                "watched": entry["episode"],
+                "next_episode": next_ep,
+                "latest_episode": max(available, key=history.episode_key),
+                "position": entry["position"],
+                "duration": entry["duration"],
+                "updated": entry["updated"],
+            }
+        )
+    return {"continue": result}
+
+
+# Longest an SSE response holds a worker thread; EventSource reconnects
+# with Last-Event-ID, so nothing is missed
+SSE_MAX_SECONDS = 300
+SSE_HEARTBEAT = 15
+# Each subscriber holds a worker thread, so only this many per worker;
+# more are turned away and their EventSource retries later
+SSE_MAX_SUBSCRIBERS = int(os.environ.get("ANI_SSE_MAX_SUBSCRIBERS", "4"))
+sse_slots = threading.BoundedSemaphore(SSE_MAX_SUBSCRIBERS)
+
+
+@app.route("/api/airing/track", methods=["POST"])
+def airing_track():
+    data = request.get_json(silent=True) or {}
+    anime_ids = data.get("anime_ids") or []
+    if not isinstance(anime_ids, list) or not anime_ids:
+        return {"error": "anime_ids must be a non-empty list."}, 400
+    return {"added": airing.tracker.track(anime_ids)}
+
+
+@app.route("/api/airing/track/<anime_id>", methods=["DELETE"])
+def airing_untrack(anime_id):
+    return {"removed": airing.tracker.untrack(anime_id)}
+
+
+@app.route("/api/new-episodes")
+def new_episodes():
+    since = request.args.get("since", 0, type=int)
+    limit = min(request.args.get("limit", 100, type=int), airing.FEED_SIZE)
+    events = airing.tracker.events(since, limit)
+    return {"events": events, "last_event": airing.tracker.last_event()}
+
+
+@app.route("/api/new-episodes/stream")
+def new_episodes_stream():
+    """Server-Sent Events: one "episode" event per show and language gaining episodes."""
+    since = request.headers.get("Last-Event-ID", type=int)
+    if since is None:
+        since = request.args.get("since", airing.tracker.last_event(), type=int)
+    if not sse_slots.acquire(blocking=False):
+        return {"error": "Too many subscribers"}, 503, {"Retry-After": "30"}
+
+    def stream(since):
+        yield "retry: 3000\n\n"
+        end = time.monotonic() + SSE_MAX_SECONDS
+        while time.monotonic() < end:
+            events = airing.tracker.wait(since, SSE_HEARTBEAT)
+            if not events:
+                yield ": keep-alive\n\n"
+            for event in events:
+                since = event["id"]
+                yield f"id: {since}\nevent: episode\ndata: {json.dumps(event)}\n\n"
+
+    response = Response(
+        stream(since),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.call_on_close(sse_slots.release)
+    return response
+
+
+@app.route("/api/sources/health")
+def sources_health():
+    return {"hosts": source_health.monitor.stats()}
+
+
+@app.route("/api/upstream/stats")
+def upstream_stats():
+    return dict(
+        upstream.stats(),
+        cache=cache.stats(),
+        sources_coalescing=sources_inflight.stats(),
+        prefetch=prefetch.prefetcher.stats(),
+        show_index=show_index.index.stats(),
+        show_batches=batch.show_loader.stats(),
+        profiler=profiler.profiler.stats(),
+        enrichment=posters.enricher.stats(),
+        airing=airing.tracker.stats(),
+        admission={"clients": admission.clients.stats(), "upstream": admission.budget.stats()},
+    )
+
+
+@app.route("/anime/<anime_id>")
+def anime_detail(anime_id):
+    try:
+        show = fetch_show(anime_id)
+    except upstream.UpstreamError:
+        return http_cache.uncached(f"Error loading episodes for ID {anime_id}")
 
-    data = response.json()
-    show = data.get("data", {}).get("show", {})
     name = show.get("name", "Unknown Anime")
     episode_data = show.get("availableEpisodesDetail", {})
     episodes = sorted(episode_data.get("sub", []), key=lambda x: float(x))
 
-    return render_template(
+    page = render_template(
         "episodes.html", anime_id=anime_id, name=name, episodes=episodes
     )
+    return page if show else http_cache.uncached(page)
 
 
 def substitute_hex(input_str):
-    subs = {
-        "01": "9",
-        "08": "0",
-        "05": "=",
-        "0a": "2",
-        "0b": "3",
-        "0c": "4",
-        "07": "?",
-        "00": "8",
-        "5c": "d",
-        "0f": "7",
-        "5e": "f",
-        "17": "/",
-        "54": "l",
-        "09": "1",
-        "48": "p",
-        "4f": "w",
-        "0e": "6",
-        "5b": "c",
-        "5d": "e",
-        "0d": "5",
-        "53": "k",
-        "1e": "&",
-        "5a": "b",
-        "59": "a",
-        "4a": "r",
-        "4c": "t",
-        "4e": "v",
-        "57": "o",
-        "51": "i",
-    }
+    return provider_url(decoder.decode(input_str))
 
-    # Split input string into 2-character hex pairs
-    pairs = [input_str[i : i + 2] for i in range(0, len(input_str), 2)]
 
-    # Apply substitutions
-    result = "".join(subs.get(pair, chr(int(pair, 16))) for pair in pairs)
-    if "clock" in result:
-        result = result.replace("clock", "clock.json")
-        result = f"https://allanime.day{result}"
+def provider_url(decoded):
+    if "clock" in decoded:
+        decoded = decoded.replace("clock", "clock.json")
+        decoded = f"{upstream.PROVIDER_BASE}{decoded}"
 
-    return result
+    return decoded
 
 
 def play_episode_online_with_name(anime_name, anime_id, ep_number, lang="sub"):
     usable_urls = fetch_usable_urls(
-        data={"anime_id": anime_id, "ep_number": ep_number, "lang": lang}
+        data={"anime_id": anime_id, "ep_number": ep_number, "lang": lang},
+        first_good=True,
     ).get("urls", [])
+    prefetch_next_episode(anime_id, ep_number, lang)
+    remember_watch(anime_id, ep_number, anime_name, lang, user=history_user())
 
     # If only one .m3u8 URL, redirect to external player
     non_m3u8_url = False
@@ -340,7 +755,9 @@ def play_episode_online_with_name(anime_name, anime_id, ep_number, lang="sub"):
                 non_m3u8_url = True
                 break
     if not non_m3u8_url:
-        encoded_url = urllib.parse.quote(usable_urls[0], safe="")
+        # The playlist and its segments need the provider's referer
+        proxied_url = proxy.proxy_url(usable_urls[0], external=True)
+        encoded_url = urllib.parse.quote(proxied_url, safe="")
         redirect_url = f"https://allanime.day/player?url={encoded_url}"
         return redirect(redirect_url)
 
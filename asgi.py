@@ -0,0 +1,471 @@
+"""
+ASGI entry point: uvicorn asgi:app --workers 4
+
+The Stremio routes and the upstream-bound /api routes run as coroutines on
+aio_upstream, so a provider fan-out holds no thread while it waits and one
+process can keep hundreds of resolutions in flight. Every other route is
+passed through to the Flask app unchanged. wsgi.py remains the sync entry
+point. Needs the optional packages in requirements-async.txt.
+"""
+import asyncio
+import json
+import math
+import re
+import time
+import urllib.parse
+
+import aiohttp
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.http import parse_etags
+
+import admission
+import app as views
+import batch
+import cache
+import http_cache
+import metrics
+import serving
+import show_index
+import source_health
+import stremeo_functions as stremio
+import upstream
+from aio_upstream import client
+from flask_app import app as flask_app
+
+UPSTREAM_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, upstream.UpstreamError)
+
+# Tasks that outlive their request (background cache fills)
+_background = set()
+
+
+def background(coro):
+    task = asyncio.ensure_future(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+
+async def cached(store, key, load):
+    """get_or_load for coroutines: fresh hits, stale hits refreshed behind, misses loaded."""
+    value, state = store.lookup(key)
+    if state == cache.FRESH:
+        return value
+    if state == cache.STALE:
+
+        async def refresh():
+            admission.set_lane("background")
+            try:
+                store.set(key, await load())
+            except UPSTREAM_ERRORS:
+                pass
+
+        background(client.coalesce(("refresh", store.name, cache.make_key(key)), refresh))
+        return value
+    value = await load()
+    store.set(key, value)
+    return value
+
+
+# --- Upstream lookups ---
+
+
+async def search_shows(query, page=1):
+    async def load():
+        variables = views.search_variables(query, page)
+        return views.parse_search(await client.graphql(views.GRAPHQL_SEARCH_QUERY, variables, "search"))
+
+    return await cached(views.search_cache, (query, page), load)
+
+
+async def fetch_shows(anime_ids):
+    shows = {}
+    missing = []
+    for anime_id in dict.fromkeys(anime_ids):
+        show = views.show_cache.get(anime_id)
+        if show is None:
+            missing.append(anime_id)
+        else:
+            shows[anime_id] = show
+
+    async def fetch_chunk(chunk):
+        variables = {f"id{i}": anime_id for i, anime_id in enumerate(chunk)}
+        query = batch.show_batch_query(len(chunk))
+        response = await client.graphql(query, variables, "show_batch")
+        return batch.parse_show_batch(response, chunk)
+
+    chunks = [missing[i : i + batch.BATCH_SIZE] for i in range(0, len(missing), batch.BATCH_SIZE)]
+    for result in await asyncio.gather(*(fetch_chunk(chunk) for chunk in chunks)):
+        for anime_id, show in result.items():
+            if show:
+                views.show_cache.set(anime_id, show)
+            shows[anime_id] = show
+    return shows
+
+
+async def fetch_show(anime_id):
+    return (await fetch_shows([anime_id]))[anime_id]
+
+
+async def fetch_provider_links(url):
+    try:
+        res = await client.get(url)
+        res.raise_for_status()
+        links = res.json().get("links", [])
+    except UPSTREAM_ERRORS + (ValueError,):
+        return []
+    return views.links_from(links)
+
+
+async def resolve_provider_urls(provider_urls, first_good=False, on_complete=None):
+    """Coroutine version of app.resolve_provider_urls, same deadline and early exit."""
+    metrics.provider_fanout.observe(len(provider_urls))
+    tasks = [asyncio.ensure_future(fetch_provider_links(url)) for url in provider_urls]
+    usable_urls = []
+    pending = set(tasks)
+    loop = asyncio.get_running_loop()
+    end = loop.time() + views.SOURCE_DEADLINE
+
+    while pending:
+        remaining = end - loop.time()
+        if remaining <= 0:
+            break
+        done, pending = await asyncio.wait(
+            pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in done:
+            usable_urls.extend(task.result())
+        if first_good and any(views.priority(link) == views.TOP_PRIORITY for link in usable_urls):
+            break
+
+    if on_complete is not None:
+        if pending:
+
+            async def collect():
+                await asyncio.wait(tasks)
+                on_complete(views.rank_links([link for task in tasks for link in task.result()]))
+
+            background(collect())
+        else:
+            on_complete(views.rank_links(usable_urls))
+
+    return views.rank_links(usable_urls)
+
+
+async def fetch_usable_urls(data, first_good=None):
+    if first_good is None:
+        first_good = data.get("first_good", False)
+    key = ("sources", data["anime_id"], str(data["ep_number"]), data["lang"], bool(first_good))
+    return await client.coalesce(key, lambda: _fetch_usable_urls(data, first_good))
+
+
+async def _fetch_usable_urls(data, first_good):
+    variables, cache_key = views.episode_variables(data)
+    cached_urls, state = views.sources_cache.lookup(cache_key)
+    if state == cache.FRESH:
+        return {"urls": source_health.monitor.rank(cached_urls, views.priority)}
+
+    try:
+        response = await client.graphql(views.GRAPHQL_SOURCES_QUERY, variables, "episode", hedge=True)
+    except UPSTREAM_ERRORS as e:
+        if cached_urls is not None:
+            urls = source_health.monitor.rank(cached_urls, views.priority)
+            return {"urls": urls, "stale": state == cache.STALE}
+        return {"urls": [], "error": str(e)}
+    if response.status_code != 200:
+        return response.json(), response.status_code
+
+    usable_urls = await resolve_provider_urls(
+        views.provider_urls_from(response.json()),
+        first_good=first_good,
+        on_complete=views.store_sources(cache_key),
+    )
+    return {"urls": usable_urls}
+
+
+# --- Handlers: (request, **path params) -> body, (body, status) or (body, status, headers) ---
+
+
+async def catalog(request, type_, id, extra=""):
+    query, page, offset = stremio.catalog_page(extra)
+    try:
+        shows = stremio.local_catalog_shows(query, page)
+        if shows is None:
+            shows = await search_shows(query, page)
+    except UPSTREAM_ERRORS:
+        return http_cache.uncached({"metas": []})
+    return stremio.catalog_body(query, page, offset, shows)
+
+
+async def meta(request, type_, id):
+    anime_id = id.replace("allanime:", "")
+    show = await fetch_show(anime_id)
+    body = stremio.meta_body(anime_id, show)
+    return body if show else http_cache.uncached(body)
+
+
+async def stream(request, type_, id):
+    parts = id.split(":")
+    anime_id, ep_number = parts[1], parts[2]
+    try:
+        show = await fetch_show(anime_id)
+    except UPSTREAM_ERRORS + (ValueError,):
+        show = None
+    langs = stremio.episode_langs(show, ep_number)
+    results = await asyncio.gather(
+        *(fetch_usable_urls({"anime_id": anime_id, "ep_number": ep_number, "lang": lang}) for lang in langs)
+    )
+    urls = {
+        lang: result.get("urls", []) if isinstance(result, dict) else []
+        for lang, result in zip(langs, results)
+    }
+    for lang in langs:
+        views.prefetch_next_episode(anime_id, ep_number, lang)
+    # Proxy links are built with url_for, which needs Flask's view of this request
+    with flask_app.test_request_context(request.path, base_url=request.base_url):
+        body = stremio.stream_body(urls)
+    return body if body["streams"] else http_cache.uncached(body)
+
+
+async def api_search(request):
+    # Same body as app.api_search, errors included
+    query = request.args.get("query", "").strip()
+    if not query:
+        return http_cache.uncached({"shows": {"error": "Please enter a search term."}})
+    shows, fresh = show_index.index.search(query)
+    show_index.index.record(local=fresh)
+    if not fresh:
+        try:
+            shows = await search_shows(query)
+        except upstream.UpstreamError as e:
+            return http_cache.uncached({"shows": {"error": f"Error: {e.status_code}"}})
+    return {"shows": sorted(shows, key=lambda x: x.get("name", "z"))}
+
+
+async def anime_episode(request):
+    anime_id = request.json()["anime_id"]
+    try:
+        show = await fetch_show(anime_id)
+    except UPSTREAM_ERRORS:
+        return f"Error loading episodes for ID {anime_id}"
+    episode_data = show.get("availableEpisodesDetail", {})
+    return {"episodes": sorted(episode_data.get("sub", []), key=lambda x: float(x))}
+
+
+async def anime_episode_play(request):
+    return await fetch_usable_urls(request.json())
+
+
+async def anime_batch(request):
+    data = request.json() or {}
+    anime_ids = data.get("anime_ids") or []
+    if not isinstance(anime_ids, list) or not anime_ids:
+        return {"error": "anime_ids must be a non-empty list."}, 400
+    if len(anime_ids) > views.MAX_BATCH_IDS:
+        return {"error": f"At most {views.MAX_BATCH_IDS} anime_ids per request."}, 400
+    try:
+        shows = await fetch_shows(anime_ids)
+    except upstream.UpstreamError as e:
+        return {"error": f"Error: {e.status_code}"}, e.status_code
+
+    result = {}
+    for anime_id, show in shows.items():
+        episode_data = show.get("availableEpisodesDetail") or {}
+        result[anime_id] = {
+            "name": show.get("name", "Unknown Anime"),
+            "episodes": {
+                lang: sorted(episode_data.get(lang, []), key=lambda x: float(x))
+                for lang in ("sub", "dub")
+            },
+        }
+    return {"shows": result}
+
+
+def rule(pattern):
+    """Compiles a Flask-style rule; the rule string doubles as the metrics/cache label."""
+    return re.compile("^" + re.sub(r"<(\w+)>", r"(?P<\1>[^/]+?)", re.escape(pattern)) + "$")
+
+
+ROUTES = [
+    ("GET", "/catalog/<type_>/<id>.json", catalog),
+    ("GET", "/catalog/<type_>/<id>/<extra>.json", catalog),
+    ("GET", "/meta/<type_>/<id>.json", meta),
+    ("GET", "/stream/<type_>/<id>.json", stream),
+    ("GET", "/api/search", api_search),
+    ("POST", "/api/anime/episode", anime_episode),
+    ("POST", "/api/anime/episode/play", anime_episode_play),
+    ("POST", "/api/anime/batch", anime_batch),
+]
+COMPILED = [(method, pattern, rule(pattern), handler) for method, pattern, handler in ROUTES]
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.query_string = scope.get("query_string", b"").decode("latin-1")
+        self.scheme = scope.get("scheme", "http")
+        self.args = dict(urllib.parse.parse_qsl(self.query_string))
+        self.headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        self.body = body
+
+    @property
+    def base_url(self):
+        return f"{self.scheme}://{self.headers.get('host', 'localhost')}"
+
+    @property
+    def full_path(self):
+        # Same key as Flask's request.full_path, so both share remembered ETags
+        return f"{self.path}?{self.query_string}"
+
+    def json(self):
+        return json.loads(self.body) if self.body else None
+
+    def encoding(self):
+        accepted = self.headers.get("accept-encoding", "")
+        if http_cache.brotli is not None and "br" in accepted:
+            return "br"
+        return "gzip" if "gzip" in accepted else None
+
+
+def match(method, path):
+    for route_method, pattern, regex, handler in COMPILED:
+        if route_method == method or (route_method == "GET" and method == "HEAD"):
+            m = regex.match(path)
+            if m:
+                return pattern, handler, m.groupdict()
+    return None
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_response(send, status, headers, body=b"", head=False):
+    headers = [(k.encode("latin-1"), str(v).encode("latin-1")) for k, v in headers]
+    headers.append((b"content-length", str(len(body)).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": b"" if head else body})
+
+
+def unpack(result):
+    """(body, status, headers) from whichever form a handler returned."""
+    if not isinstance(result, tuple):
+        return result, 200, {}
+    if len(result) == 2:
+        return result[0], result[1], {}
+    return result
+
+
+async def handle(scope, receive, send, pattern, handler, params):
+    request = Request(scope, await read_body(receive))
+    head = request.method == "HEAD"
+    policy = http_cache.POLICIES.get(pattern) if request.method in ("GET", "HEAD") else None
+    if_none_match = parse_etags(request.headers.get("if-none-match"))
+
+    # Revalidation answered from the remembered ETag, as in http_cache
+    if policy and if_none_match:
+        tag = http_cache.remembered_tag(request.full_path, request.encoding())
+        if tag and if_none_match.contains(tag):
+            headers = [("etag", f'"{tag}"'), ("cache-control", policy), ("vary", "Accept-Encoding")]
+            return 304, headers, b""
+
+    body, status, extra = unpack(await handler(request, **params))
+    if isinstance(body, str):
+        content_type, data = "text/html; charset=utf-8", body.encode()
+    else:
+        content_type = "application/json"
+        data = (json.dumps(body, sort_keys=True, separators=(",", ":")) + "\n").encode()
+
+    headers = [("content-type", content_type), ("access-control-allow-origin", "*")]
+    headers += [(name.lower(), value) for name, value in extra.items()]
+    compressible = len(data) >= http_cache.COMPRESS_MIN_BYTES
+    encoding = request.encoding() if compressible else None
+    if status == 200 and policy and extra.get("Cache-Control") != http_cache.NO_STORE:
+        tag = http_cache.body_tag(data)
+        http_cache.remember(request.full_path, tag, compressible, policy)
+        etag = http_cache.variant_tag(tag, encoding)
+        headers += [("cache-control", policy), ("etag", f'"{etag}"'), ("vary", "Accept-Encoding")]
+        if if_none_match.contains(etag):
+            return 304, headers, b""
+    if encoding is not None:
+        data = http_cache.compress(data, encoding)
+        headers.append(("content-encoding", encoding))
+    return status, headers, data
+
+
+def behind_proxies(scope):
+    """scope with the client, scheme and host the trusted proxies forwarded."""
+    headers = {k.decode("latin-1").lower(): v for k, v in scope["headers"]}
+    client = admission.forwarded(headers.get("x-forwarded-for", b"").decode("latin-1"))
+    scheme = admission.forwarded(headers.get("x-forwarded-proto", b"").decode("latin-1"))
+    host = admission.forwarded(headers.get("x-forwarded-host", b"").decode("latin-1"))
+    scope = dict(scope)
+    if client:
+        scope["client"] = (client, 0)
+    if scheme:
+        scope["scheme"] = scheme
+    if host:
+        scope["headers"] = [(k, v) for k, v in scope["headers"] if k.lower() != b"host"]
+        scope["headers"].append((b"host", host.encode("latin-1")))
+    return scope
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            views.start_background_jobs()
+            serving.start_warm_up()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            serving.begin_drain()
+            await client.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+wsgi_fallback = WsgiToAsgi(flask_app)
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return await wsgi_fallback(scope, receive, send)
+    if admission.TRUSTED_PROXIES:
+        scope = behind_proxies(scope)
+
+    found = match(scope["method"], scope["path"])
+    if found is None:
+        return await wsgi_fallback(scope, receive, send)
+
+    pattern, handler, params = found
+    admission.set_lane(admission.lane_for_route(pattern))
+    wait = admission.clients.check((scope.get("client") or ("unknown",))[0])
+    if wait:
+        headers = [("content-type", "application/json"), ("retry-after", max(1, math.ceil(wait)))]
+        return await send_response(send, 429, headers, b'{"error": "Too many requests."}\n')
+
+    start = time.monotonic()
+    metrics.http_in_flight.inc(route=pattern)
+    status, error = 500, None
+    try:
+        status, headers, body = await handle(scope, receive, send, pattern, handler, params)
+    except Exception as e:
+        error = e
+        headers = [("content-type", "application/json")]
+        body = json.dumps({"error": "Internal Server Error"}).encode()
+    finally:
+        metrics.http_in_flight.dec(route=pattern)
+        metrics.http_seconds.observe(
+            time.monotonic() - start, route=pattern, method=scope["method"], status=status
+        )
+    await send_response(send, status, headers, body, head=scope["method"] == "HEAD")
+    if error is not None:
+        # Let the server log the traceback once the client has its 500
+        raise error
@@ -0,0 +1,130 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import admission
+import upstream
+
+# --- Configuration ---
+# Most show lookups merged into one aliased GraphQL request
+BATCH_SIZE = int(os.environ.get("ANI_BATCH_SIZE", "25"))
+# How long a loader waits for more keys before sending a batch
+BATCH_WINDOW = float(os.environ.get("ANI_BATCH_WINDOW", "0.003"))
+# Full batches sent upstream at once, e.g. by one large load_many
+BATCH_WORKERS = int(os.environ.get("ANI_BATCH_WORKERS", "4"))
+
+SHOW_FIELDS = "_id name availableEpisodesDetail"
+
+
+def show_batch_query(count):
+    """One query with aliases s0..sN, each a show(_id:) lookup."""
+    params = ", ".join(f"$id{i}: String!" for i in range(count))
+    fields = "\n".join(
+        f"  s{i}: show(_id: $id{i}) {{ {SHOW_FIELDS} }}" for i in range(count)
+    )
+    return f"query ({params}) {{\n{fields}\n}}"
+
+
+def fetch_shows(anime_ids):
+    """Looks up many shows, BATCH_SIZE per request. Unknown ids map to {}."""
+    anime_ids = list(dict.fromkeys(anime_ids))
+    shows = {}
+    for start in range(0, len(anime_ids), BATCH_SIZE):
+        chunk = anime_ids[start : start + BATCH_SIZE]
+        variables = {f"id{i}": anime_id for i, anime_id in enumerate(chunk)}
+        response = upstream.graphql(show_batch_query(len(chunk)), variables, "show_batch")
+        shows.update(parse_show_batch(response, chunk))
+    return shows
+
+
+def parse_show_batch(response, chunk):
+    """{anime_id: show} from a show_batch_query response; raises UpstreamError for a failed one."""
+    if response.status_code != 200:
+        raise upstream.UpstreamError(response.status_code)
+    body = response.json()
+    # GraphQL reports failures in a 200; they must not read as unknown shows
+    if body.get("errors") or body.get("data") is None:
+        raise upstream.UpstreamError(response.status_code, f"GraphQL errors: {body.get('errors')}")
+    data = body["data"]
+    return {anime_id: data.get(f"s{i}") or {} for i, anime_id in enumerate(chunk)}
+
+
+class Loader:
+    """
+    DataLoader-style batching: load() returns a Future right away, and keys
+    requested within the collect window go upstream together through
+    batch_fn, which takes a list of keys and returns a dict. Batches that
+    fill up are sent on a small pool, so a large load_many runs them in
+    parallel. A batch goes upstream in the most urgent admission lane of
+    the callers waiting on it.
+    """
+
+    def __init__(self, batch_fn, max_batch=BATCH_SIZE, window=BATCH_WINDOW, workers=BATCH_WORKERS):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.window = window
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._lane = None
+        self._timer = None
+        self.counters = {"keys": 0, "batches": 0}
+
+    def load(self, key):
+        batch = None
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            future = self._pending[key] = Future()
+            lane = admission.current_lane()
+            self._lane = lane if self._lane is None else admission.more_urgent(self._lane, lane)
+            self.counters["keys"] += 1
+            if len(self._pending) >= self.max_batch:
+                batch = self._take()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.window, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if batch:
+            self._executor.submit(self._dispatch, *batch)
+        return future
+
+    def load_many(self, keys):
+        futures = [self.load(key) for key in keys]
+        return [future.result() for future in futures]
+
+    def _take(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        lane, self._lane = self._lane, None
+        if not batch:
+            return None
+        self.counters["batches"] += 1
+        return batch, lane
+
+    def _flush(self):
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._dispatch(*batch)
+
+    def _dispatch(self, batch, lane):
+        try:
+            with admission.lane(lane):
+                results = self.batch_fn(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                future.set_exception(e)
+            return
+        for key, future in batch.items():
+            future.set_result(results.get(key))
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, pending=len(self._pending))
+
+
+show_loader = Loader(fetch_shows)
@@ -0,0 +1,81 @@
+"""
+Micro-benchmark and cross-check for decoder.py.
+
+Run from the repository root:
+    python benchmarks/decoder_bench.py
+"""
+import os
+import random
+import re
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import decoder  # noqa: E402
+
+
+def shell_table():
+    """Reads the pair -> character table out of ani-cli's provider_init."""
+    with open(os.path.join(ROOT, "ani-cli")) as f:
+        script = f.read()
+    body = script[script.index("provider_init() {") :]
+    body = body[: body.index("\n}")]
+    table = {}
+    for pair, char in re.findall(r"s/\^([0-9a-f]{2})\$/(\\?.)/g", body):
+        table[pair] = char.lstrip("\\") or char
+    return table
+
+
+def legacy_decode(encoded, table):
+    # The previous app.substitute_hex approach: slice pairs, look each one up
+    pairs = [encoded[i : i + 2] for i in range(0, len(encoded), 2)]
+    return "".join(table.get(pair, chr(int(pair, 16))) for pair in pairs)
+
+
+def cross_check(table):
+    mismatches = [
+        (pair, char, decoder.decode(pair))
+        for pair, char in table.items()
+        if decoder.decode(pair) != char
+    ]
+    if mismatches:
+        for pair, want, got in mismatches:
+            print(f"MISMATCH {pair}: shell={want!r} decoder={got!r}")
+        sys.exit(1)
+    print(f"cross-check: {len(table)} shell table entries match")
+
+
+def sample_ids(table, count, length):
+    encode = {char: pair for pair, char in table.items()}
+    alphabet = "".join(encode)
+    rng = random.Random(0)
+    ids = []
+    for _ in range(count):
+        text = "/apivtwo/clock?id=" + "".join(rng.choice(alphabet) for _ in range(length))
+        ids.append("".join(encode[c] for c in text))
+    return ids
+
+
+def main():
+    table = shell_table()
+    cross_check(table)
+
+    ids = sample_ids(table, count=8, length=120)
+    assert [legacy_decode(i, table) for i in ids] == decoder.decode_many(ids)
+
+    number = 20000
+    timings = {
+        "legacy (per pair dict)": lambda: [legacy_decode(i, table) for i in ids],
+        "decoder.decode": lambda: [decoder.decode(i) for i in ids],
+        "decoder.decode_many": lambda: decoder.decode_many(ids),
+    }
+    print(f"{len(ids)} ids per episode, {number} episodes")
+    for name, fn in timings.items():
+        elapsed = timeit.timeit(fn, number=number)
+        print(f"  {name:<24} {elapsed / number * 1e6:8.2f} us/episode")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Local stand-in for the AllAnime API, for load tests that must not touch
+the real upstream.
+
+It answers the GraphQL queries the app sends (shows, show and its aliased
+batch form, episodeList, episode) and serves /apivtwo/clock.json link
+payloads plus small media files, with injected latency and errors.
+
+Run on its own:
+    python benchmarks/fake_allanime.py --port 8900 --latency 0.05 --error-rate 0.01
+and point the app at it with
+    ANI_API_URL=http://127.0.0.1:8900/api ANI_PROVIDER_BASE=http://127.0.0.1:8900
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+KEY = 0x38
+SHOWS = 500
+EPISODES = 24
+PROVIDERS_PER_EPISODE = 4
+WORDS = ["blade", "sky", "ghost", "iron", "moon", "river", "shadow", "crown", "star", "ember"]
+ALIAS = re.compile(r"(\w+):\s*show\(_id:\s*\$(\w+)\)")
+
+
+def encode(text):
+    """Inverse of decoder.decode: XOR every byte with the key, as hex."""
+    return bytes(b ^ KEY for b in text.encode("latin-1")).hex()
+
+
+def show_id(n):
+    return f"fake{n:05d}"
+
+
+def show(n):
+    rng = random.Random(n)
+    name = " ".join(rng.choice(WORDS) for _ in range(3)).title() + f" {n}"
+    episodes = [str(e) for e in range(EPISODES, 0, -1)]
+    return {
+        "_id": show_id(n),
+        "name": name,
+        "availableEpisodes": {"sub": EPISODES, "dub": EPISODES // 2},
+        "availableEpisodesDetail": {"sub": episodes, "dub": episodes[EPISODES // 2 :]},
+    }
+
+
+CATALOG = [show(n) for n in range(SHOWS)]
+BY_ID = {s["_id"]: s for s in CATALOG}
+
+
+class Config:
+    latency = 0.0
+    jitter = 0.0
+    error_rate = 0.0
+    provider_latency = 0.0
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _delay(self, base):
+        delay = base + random.uniform(0, Config.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if random.random() < Config.error_rate:
+            self._send(random.choice([500, 502, 503]), {"errors": [{"message": "injected"}]})
+            return False
+        return True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if not self._delay(Config.latency):
+            return
+        self._send(200, {"data": graphql(payload.get("query", ""), payload.get("variables") or {})})
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        if url.path == "/apivtwo/clock.json":
+            if not self._delay(Config.provider_latency):
+                return
+            self._send(200, {"links": provider_links(self.headers.get("Host"), params)})
+        elif url.path.startswith("/media/"):
+            self._send(200, bytes(64 * 1024), "video/mp4")
+        elif url.path == "/health":
+            self._send(200, {"ok": True})
+        else:
+            self._send(404, {"error": "not found"})
+
+    do_HEAD = do_GET
+
+
+def graphql(query, variables):
+    if "episodeList" in query:
+        return {"episodeList": [{"episodeString": str(e)} for e in range(1, EPISODES + 1)]}
+    if "episode(" in query:
+        return {"episode": episode(variables)}
+    if "shows(" in query:
+        return {"shows": {"edges": search(variables)}}
+    aliases = ALIAS.findall(query)
+    if aliases:
+        return {alias: BY_ID.get(variables.get(var)) for alias, var in aliases}
+    if "show(" in query:
+        return {"show": BY_ID.get(variables.get("showId") or variables.get("_id"))}
+    return {}
+
+
+def search(variables):
+    text = ((variables.get("search") or {}).get("query") or "").lower()
+    limit = int(variables.get("limit") or 40)
+    page = int(variables.get("page") or 1)
+    matches = [s for s in CATALOG if text in s["name"].lower()]
+    start = (page - 1) * limit
+    return [
+        {k: s[k] for k in ("_id", "name", "availableEpisodes")}
+        for s in matches[start : start + limit]
+    ]
+
+
+def episode(variables):
+    anime_id = variables.get("showId")
+    if anime_id not in BY_ID:
+        return None
+    ep = variables.get("episodeString")
+    lang = variables.get("translationType", "sub")
+    sources = []
+    for p in range(PROVIDERS_PER_EPISODE):
+        path = f"/apivtwo/clock?id={anime_id}-{lang}-{ep}-{p}"
+        sources.append({"sourceUrl": "--" + encode(path), "sourceName": f"P{p}"})
+    return {"episodeString": ep, "sourceUrls": sources}
+
+
+def provider_links(host, params):
+    source = (params.get("id") or ["x"])[0]
+    qualities = ["1080p", "720p", "480p"]
+    return [
+        {
+            "link": f"http://{host}/media/{source}/{quality}.mp4",
+            "resolutionStr": quality,
+            "headers": {"Referer": f"http://{host}/"},
+        }
+        for quality in qualities
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.05, help="GraphQL delay, seconds")
+    parser.add_argument("--provider-latency", type=float, default=0.08)
+    parser.add_argument("--jitter", type=float, default=0.02, help="extra uniform delay")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share answered with 5xx")
+    args = parser.parse_args(argv)
+
+    Config.latency = args.latency
+    Config.provider_latency = args.provider_latency
+    Config.jitter = args.jitter
+    Config.error_rate = args.error_rate
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), Handler)
+    server.daemon_threads = True
+    print(f"fake AllAnime on http://127.0.0.1:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""
+Load test for the HTTP endpoints against a local fake AllAnime.
+
+Starts benchmarks/fake_allanime.py and the app (both as subprocesses, so
+the load generator doesn't share their GIL), then drives each scenario at
+every concurrency level and reports RPS and p50/p95/p99 latency.
+
+Run from the repository root:
+    python benchmarks/load_bench.py --concurrency 1,8,32 --duration 10
+    python benchmarks/load_bench.py --error-rate 0.05 --compare old.json
+    python benchmarks/load_bench.py --mode both --concurrency 32,128
+
+--mode async runs the ASGI app (asgi.py under uvicorn, which needs
+requirements-async.txt) instead of the threaded Flask server; both runs
+the two against the same fake upstream and prints the difference.
+
+Results go to benchmarks/results/ as JSON, which --compare reads back to
+print the change against an earlier run.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import fake_allanime  # noqa: E402
+
+APP_RUNNER = (
+    "import sys; sys.path.insert(0, {root!r}); "
+    "from stremeo_functions import app; "
+    "app.run(host='127.0.0.1', port={port}, threaded=True)"
+)
+ASYNC_RUNNER = [
+    "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", "{port}",
+    "--no-access-log", "--log-level", "warning",
+]
+MODES = ("sync", "async")
+WORDS = fake_allanime.WORDS
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(url, timeout=30):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            if requests.get(url, timeout=1).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+# --- Scenarios: each returns (method, path, json body or None) ---
+
+
+def pick_show(rng, keyspace):
+    return fake_allanime.show_id(rng.randrange(keyspace))
+
+
+def search(rng, keyspace):
+    return "GET", f"/api/search?query={rng.choice(WORDS)}%20{rng.randrange(keyspace)}", None
+
+
+def play(rng, keyspace):
+    body = {
+        "anime_id": pick_show(rng, keyspace),
+        "ep_number": str(rng.randint(1, fake_allanime.EPISODES)),
+        "lang": rng.choice(["sub", "dub"]),
+    }
+    return "POST", "/api/anime/episode/play", body
+
+
+def catalog(rng, keyspace):
+    if rng.random() < 0.5:
+        return "GET", f"/catalog/anime/allanime.catalog/skip={rng.randrange(0, 400, 40)}.json", None
+    return "GET", f"/catalog/anime/allanime.catalog/search={rng.choice(WORDS)}.json", None
+
+
+def meta(rng, keyspace):
+    return "GET", f"/meta/anime/allanime:{pick_show(rng, keyspace)}.json", None
+
+
+def stream(rng, keyspace):
+    ep = rng.randint(1, fake_allanime.EPISODES)
+    return "GET", f"/stream/anime/allanime:{pick_show(rng, keyspace)}:{ep}.json", None
+
+
+SCENARIOS = {"search": search, "play": play, "catalog": catalog, "meta": meta, "stream": stream}
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_level(base_url, scenario, concurrency, duration, keyspace, seed):
+    """Runs one scenario with `concurrency` closed-loop clients for `duration` seconds."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    end = time.monotonic() + duration
+
+    def client(worker):
+        rng = random.Random(seed * 1000 + worker)
+        session = requests.Session()
+        local, failed = [], 0
+        while time.monotonic() < end:
+            method, path, body = scenario(rng, keyspace)
+            start = time.perf_counter()
+            try:
+                res = session.request(method, base_url + path, json=body, timeout=30)
+                res.content
+                ok = res.status_code < 500
+            except requests.RequestException:
+                ok = False
+            local.append(time.perf_counter() - start)
+            failed += not ok
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(client, range(concurrency)))
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 2) if v is not None else None  # noqa: E731
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1] if latencies else None),
+    }
+
+
+def result_key(r):
+    # Runs from before --mode existed were all sync
+    return r.get("mode", "sync"), r["scenario"], r["concurrency"]
+
+
+def print_changes(results, before_by_key, key=result_key):
+    for r in results:
+        before = before_by_key.get(key(r))
+        if not before:
+            continue
+        parts = []
+        for field in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+            if before.get(field) and r.get(field) is not None:
+                parts.append(f"{field} {(r[field] / before[field] - 1) * 100:+.1f}%")
+        print(f"  {r['scenario']:<8} c={r['concurrency']:<4} " + "  ".join(parts))
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nchange against {baseline_path}:")
+    print_changes(results, {result_key(r): r for r in baseline["results"]})
+
+
+def compare_modes(results):
+    sync = {(r["scenario"], r["concurrency"]): r for r in results if r["mode"] == "sync"}
+    print("\nasync against sync:")
+    print_changes(
+        [r for r in results if r["mode"] == "async"],
+        sync,
+        key=lambda r: (r["scenario"], r["concurrency"]),
+    )
+
+
+def start_fake(args):
+    fake_port = free_port()
+    fake_cmd = [
+        sys.executable, os.path.join(HERE, "fake_allanime.py"),
+        "--port", str(fake_port),
+        "--latency", str(args.latency),
+        "--provider-latency", str(args.provider_latency),
+        "--jitter", str(args.jitter),
+        "--error-rate", str(args.error_rate),
+    ]
+    proc = subprocess.Popen(fake_cmd, stdout=subprocess.DEVNULL)
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    wait_ready(fake_url + "/health")
+    return fake_url, proc
+
+
+def start_app(mode, fake_url, workdir, upstream_rate=0):
+    """Starts a fresh app process with its own cache, so modes don't share warm state."""
+    app_port = free_port()
+    workdir = tempfile.mkdtemp(prefix=mode + "-", dir=workdir)
+    env = dict(
+        os.environ,
+        ANI_API_URL=fake_url + "/api",
+        ANI_PROVIDER_BASE=fake_url,
+        ANI_CACHE_DB=os.path.join(workdir, "cache.db"),
+        ANI_HISTORY_DB=os.path.join(workdir, "history.db"),
+        ANI_LOG_SAMPLE="0",
+        # Every simulated client shares one IP
+        ANI_CLIENT_RATE="0",
+        ANI_UPSTREAM_RATE=str(upstream_rate),
+        PYTHONPATH=ROOT,
+    )
+    if mode == "async":
+        cmd = [sys.executable] + [arg.format(port=app_port) for arg in ASYNC_RUNNER]
+    else:
+        cmd = [sys.executable, "-c", APP_RUNNER.format(root=ROOT, port=app_port)]
+    proc = subprocess.Popen(
+        cmd, env=env, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    app_url = f"http://127.0.0.1:{app_port}"
+    wait_ready(app_url + "/manifest.json")
+    return app_url, proc
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated levels")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per level")
+    parser.add_argument("--keyspace", type=int, default=200, help="distinct shows requested")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--provider-latency", type=float, default=0.08)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--upstream-rate", type=float, default=0,
+                        help="app's upstream budget in requests/s (default 0, unlimited)")
+    parser.add_argument("--mode", choices=MODES + ("both",), default="sync",
+                        help="threaded Flask app, ASGI app, or both in turn")
+    parser.add_argument("--app-url", help="benchmark a running app instead of starting one")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="JSON results path (default benchmarks/results/)")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    args = parser.parse_args(argv)
+
+    names = [n for n in args.scenarios.split(",") if n]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    levels = [int(c) for c in args.concurrency.split(",")]
+    keyspace = min(args.keyspace, fake_allanime.SHOWS)
+
+    modes = MODES if args.mode == "both" else (args.mode,)
+    if args.app_url and len(modes) > 1:
+        parser.error("--app-url runs a single mode")
+
+    procs = []
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            if not args.app_url:
+                fake_url, fake = start_fake(args)
+                procs.append(fake)
+            print(f"{'mode':<6} {'scenario':<8} {'conc':>5} {'reqs':>7} {'err':>5} {'rps':>8} "
+                  f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+            for mode in modes:
+                if args.app_url:
+                    base_url = args.app_url.rstrip("/")
+                else:
+                    base_url, app = start_app(mode, fake_url, workdir, args.upstream_rate)
+                    procs.append(app)
+                for name in names:
+                    for level in levels:
+                        r = run_level(base_url, SCENARIOS[name], level, args.duration, keyspace, args.seed)
+                        r["scenario"] = name
+                        r["mode"] = mode
+                        results.append(r)
+                        print(f"{mode:<6} {name:<8} {level:>5} {r['requests']:>7} {r['errors']:>5} "
+                              f"{r['rps']:>8} {r['p50_ms']!s:>8} {r['p95_ms']!s:>8} {r['p99_ms']!s:>8}")
+        finally:
+            for proc in procs:
+                proc.terminate()
+                proc.wait(timeout=10)
+
+    output = args.output or os.path.join(
+        HERE, "results", time.strftime("load-%Y%m%d-%H%M%S.json")
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "timestamp": time.time(),
+                "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"\nwrote {output}")
+    if len(modes) > 1:
+        compare_modes(results)
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import sqlite_local
+
+# --- Configuration ---
+# Set ANI_CACHE_DB to a file path to enable the shared on-disk tier.
+# Every worker process opening the same file sees the same entries.
+CACHE_DB_PATH = os.environ.get("ANI_CACHE_DB", "")
+# Memory budget of each named cache
+CACHE_MAX_BYTES = int(os.environ.get("ANI_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+FRESH = "fresh"
+STALE = "stale"
+MISS = "miss"
+
+
+def make_key(key):
+    if isinstance(key, str):
+        return key
+    return json.dumps(key, sort_keys=True, separators=(",", ":"))
+
+
+class DiskTier:
+    """SQLite store shared by all caches and all worker processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._connections = sqlite_local.LocalConnections(path)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cache (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    fresh_until REAL NOT NULL,
+                    stale_until REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+                """
+            )
+
+    def _connect(self):
+        return self._connections.get()
+
+    def get(self, namespace, key):
+        try:
+            row = self._connect().execute(
+                "SELECT value, fresh_until, stale_until FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None or row[2] < time.time():
+            return None
+        return json.loads(row[0]), row[1], row[2]
+
+    def set(self, namespace, key, value, fresh_until, stale_until):
+        try:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), fresh_until, stale_until),
+            )
+        except sqlite3.Error:
+            pass
+
+    def delete(self, namespace, key):
+        try:
+            self._connect().execute(
+                "DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+            )
+        except sqlite3.Error:
+            pass
+
+    def purge(self):
+        try:
+            self._connect().execute(
+                "DELETE FROM cache WHERE stale_until < ?", (time.time(),)
+            )
+        except sqlite3.Error:
+            pass
+
+
+class TTLCache:
+    """
+    In-memory LRU with a byte budget, a fresh TTL and an optional stale window.
+    Entries past their TTL but inside the stale window are still served by
+    get_or_load while a background refresh replaces them.
+    """
+
+    def __init__(self, name, ttl, stale_ttl=0, max_bytes=CACHE_MAX_BYTES, disk=None):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self.counters = {
+            "hits": 0,
+            "stale_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "refreshes": 0,
+        }
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _store(self, key, value, fresh_until, stale_until):
+        size = len(json.dumps(value))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[3]
+            self._entries[key] = (value, fresh_until, stale_until, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _key, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[3]
+                self.counters["evictions"] += 1
+
+    def lookup(self, key):
+        """Returns (value, state) where state is FRESH, STALE or MISS."""
+        key = make_key(key)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[2] < now:
+                    del self._entries[key]
+                    self._bytes -= entry[3]
+                    entry = None
+                else:
+                    self._entries.move_to_end(key)
+        if entry is None and self.disk is not None:
+            row = self.disk.get(self.name, key)
+            if row is not None:
+                entry = row
+                self._store(key, *row)
+                self._count("disk_hits")
+        if entry is None:
+            self._count("misses")
+            return None, MISS
+        if entry[1] >= now:
+            self._count("hits")
+            return entry[0], FRESH
+        self._count("stale_hits")
+        return entry[0], STALE
+
+    def get(self, key):
+        value, state = self.lookup(key)
+        return value if state == FRESH else None
+
+    def set(self, key, value, ttl=None):
+        key = make_key(key)
+        now = time.time()
+        fresh_until = now + (self.ttl if ttl is None else ttl)
+        stale_until = fresh_until + self.stale_ttl
+        self._store(key, value, fresh_until, stale_until)
+        if self.disk is not None:
+            self.disk.set(self.name, key, value, fresh_until, stale_until)
+
+    def delete(self, key):
+        key = make_key(key)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[3]
+        if self.disk is not None:
+            self.disk.delete(self.name, key)
+
+    def get_or_load(self, key, loader, keep=None):
+        """keep(value), when given, decides whether a loaded value is stored."""
+        value, state = self.lookup(key)
+        if state == FRESH:
+            return value
+        if state == STALE:
+            self._refresh_in_background(key, loader, keep)
+            return value
+        value = loader()
+        if keep is None or keep(value):
+            self.set(key, value)
+        return value
+
+    def _refresh_in_background(self, key, loader, keep=None):
+        key = make_key(key)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            self.counters["refreshes"] += 1
+
+        def refresh():
+            try:
+                value = loader()
+                if keep is None or keep(value):
+                    self.set(key, value)
+            except Exception:
+                # Keep serving the stale copy until it runs out
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["stale_hits"] + self.counters["misses"]
+            return dict(
+                self.counters,
+                entries=len(self._entries),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes,
+                hit_ratio=round(
+                    (self.counters["hits"] + self.counters["stale_hits"]) / lookups, 4
+                )
+                if lookups
+                else 0.0,
+            )
+
+
+disk = DiskTier(CACHE_DB_PATH) if CACHE_DB_PATH else None
+caches = {}
+_disks = {CACHE_DB_PATH: disk} if disk else {}
+
+
+def disk_at(path):
+    if path not in _disks:
+        _disks[path] = DiskTier(path)
+    return _disks[path]
+
+
+def create(name, ttl, stale_ttl=0, max_bytes=CACHE_MAX_BYTES, disk_path=None):
+    """disk_path gives this cache an on-disk tier of its own when set."""
+    tier = disk_at(disk_path) if disk_path else disk
+    caches[name] = TTLCache(name, ttl, stale_ttl=stale_ttl, max_bytes=max_bytes, disk=tier)
+    return caches[name]
+
+
+def stats():
+    return {name: c.stats() for name, c in caches.items()}
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+# Gauge values for metrics.breaker_state
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures and rejects calls for
+    reset_timeout seconds. Then a single trial call is let through: success
+    closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self.counters = {"opened": 0, "rejected": 0, "failures": 0, "successes": 0}
+        self._set_state(CLOSED)
+
+    def _set_state(self, state):
+        self.state = state
+        metrics.breaker_state.set(STATE_VALUES[state], host=self.name)
+
+    def _count(self, event):
+        self.counters[event] += 1
+        if event in ("opened", "rejected"):
+            metrics.breaker_events.inc(host=self.name, event=event)
+
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self._count("rejected")
+                    return False
+                self._set_state(HALF_OPEN)
+                self._trial_in_flight = False
+            if self.state == HALF_OPEN:
+                if self._trial_in_flight:
+                    self._count("rejected")
+                    return False
+                self._trial_in_flight = True
+            return True
+
+    def release(self):
+        """Gives back the trial slot of a call that was allowed but never went out."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._trial_in_flight = False
+
+    def success(self):
+        with self._lock:
+            self._count("successes")
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def failure(self):
+        with self._lock:
+            self._count("failures")
+            self.failures += 1
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED and self.failures >= self.failure_threshold
+            ):
+                self._set_state(OPEN)
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+                self._count("opened")
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, state=self.state, consecutive_failures=self.failures)
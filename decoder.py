@@ -0,0 +1,49 @@
+# Decoder for the obfuscated provider ids in AllAnime sourceUrls.
+# Every id is hex text whose bytes are the plain characters XORed with 0x38,
+# which is what ani-cli's provider_init sed table spells out pair by pair.
+
+KEY = 0x38
+
+# Complete byte -> byte translation, built once at import
+TABLE = bytes(b ^ KEY for b in range(256))
+
+
+def decode(encoded):
+    """Decodes one provider id (the part after the leading '--')."""
+    return bytes.fromhex(encoded).translate(TABLE).decode("latin-1")
+
+
+def decode_each(encoded_ids):
+    """Decodes ids one by one, leaving out those that aren't valid hex."""
+    result = []
+    for encoded in encoded_ids:
+        try:
+            decoded = decode(encoded)
+        except ValueError:
+            continue
+        if len(decoded) == len(encoded) // 2:
+            result.append(decoded)
+    return result
+
+
+def decode_many(encoded_ids):
+    """
+    Decodes a batch of provider ids with a single fromhex/translate pass
+    over their concatenation, then cuts the result back apart. Malformed
+    ids are left out, so one bad source doesn't cost the others.
+    """
+    # An odd-length id would shift every id after it by half a byte
+    encoded_ids = [encoded for encoded in encoded_ids if len(encoded) % 2 == 0]
+    try:
+        decoded = decode("".join(encoded_ids))
+    except ValueError:
+        return decode_each(encoded_ids)
+    if len(decoded) * 2 != sum(map(len, encoded_ids)):
+        return decode_each(encoded_ids)  # fromhex skipped whitespace
+    result = []
+    start = 0
+    for encoded in encoded_ids:
+        end = start + len(encoded) // 2
+        result.append(decoded[start:end])
+        start = end
+    return result
@@ -0,0 +1,372 @@
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import resolver
+import upstream
+
+# --- Configuration ---
+DOWNLOAD_WORKERS = int(os.environ.get("ANI_DOWNLOAD_WORKERS", "2"))
+# Parallel connections per job, like aria2c -x 16 -s 16
+DOWNLOAD_CONNECTIONS = int(os.environ.get("ANI_DOWNLOAD_CONNECTIONS", "16"))
+MIN_PART_SIZE = 1024 * 1024
+CHUNK_SIZE = 256 * 1024
+STATE_SAVE_INTERVAL = 2.0
+
+ACTIVE = ("queued", "resolving", "downloading")
+
+
+class Cancelled(Exception):
+    pass
+
+
+def safe_filename(name):
+    return re.sub(r'[\\/:*?"<>|]+', "_", name).strip() or "episode"
+
+
+class DownloadManager:
+    """
+    Runs episode downloads in the background on a bounded pool of jobs.
+    MP4 sources are fetched as parallel byte ranges and m3u8 sources as
+    parallel segments. Jobs and their partial files live under folder, so
+    unfinished jobs pick up where they stopped after a restart.
+    """
+
+    def __init__(self, folder, workers=DOWNLOAD_WORKERS, connections=DOWNLOAD_CONNECTIONS):
+        self.folder = folder
+        self.connections = connections
+        self.state_path = os.path.join(folder, ".jobs.json")
+        self.jobs = {}
+        self._cancel = {}
+        self._lock = threading.Lock()
+        self._last_save = 0.0
+        self._pool = upstream.SessionPool(size=workers * connections)
+        self._jobs_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download")
+        self._parts_executor = ThreadPoolExecutor(
+            max_workers=workers * connections, thread_name_prefix="download-part"
+        )
+        os.makedirs(folder, exist_ok=True)
+        self._resume()
+
+    # --- job bookkeeping ---
+
+    def _resume(self):
+        if not os.path.exists(self.state_path):
+            return
+        with open(self.state_path) as f:
+            self.jobs = {job["id"]: job for job in json.load(f)}
+        for job in self.jobs.values():
+            if job["status"] in ACTIVE:
+                job["status"] = "queued"
+                self._submit(job)
+
+    def _save(self, force=True):
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_save < STATE_SAVE_INTERVAL:
+                return
+            self._last_save = now
+            data = json.dumps(list(self.jobs.values()), indent=1)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.state_path)
+
+    def _update(self, job, **fields):
+        with self._lock:
+            job.update(fields)
+        self._save(force="status" in fields)
+
+    def _add_bytes(self, job, count):
+        with self._lock:
+            job["bytes_done"] += count
+            job["session_bytes"] += count
+        self._save(force=False)
+
+    def _check_cancel(self, job):
+        if self._cancel[job["id"]].is_set():
+            raise Cancelled()
+
+    def _set_status(self, job, status, **fields):
+        """Moves a job to status, unless a cancel got there first."""
+        with self._lock:
+            if self._cancel[job["id"]].is_set():
+                raise Cancelled()
+            job.update(fields, status=status)
+        self._save()
+
+    def _submit(self, job):
+        self._cancel[job["id"]] = threading.Event()
+        self._jobs_executor.submit(self._run, job)
+
+    def enqueue(self, anime_id, episode, title=None, quality=resolver.QUALITY, mode=resolver.MODE):
+        name = safe_filename(f"{title or anime_id} Episode {episode}")
+        job = {
+            "id": uuid.uuid4().hex,
+            "anime_id": anime_id,
+            "episode": str(episode),
+            "mode": mode,
+            "quality": quality,
+            "name": name,
+            "filename": None,
+            "url": None,
+            "referer": None,
+            "kind": None,
+            "status": "queued",
+            "error": None,
+            "bytes_done": 0,
+            "bytes_total": None,
+            "segments_done": 0,
+            "segments_total": None,
+            "session_bytes": 0,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        with self._lock:
+            self.jobs[job["id"]] = job
+        self._save()
+        self._submit(job)
+        return self.describe(job)
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        with self._lock:
+            cancelled = job["status"] in ACTIVE
+            if cancelled:
+                # Under the lock, so _run can't move the job on in between
+                self._cancel[job_id].set()
+                job.update(status="cancelled", finished_at=time.time())
+        if cancelled:
+            self._save()
+        return self.describe(job)
+
+    def describe(self, job):
+        with self._lock:
+            info = {k: v for k, v in job.items() if k != "session_bytes"}
+            elapsed = None
+            if job["started_at"]:
+                elapsed = (job["finished_at"] or time.time()) - job["started_at"]
+            info["throughput_bps"] = (
+                round(job["session_bytes"] / elapsed) if elapsed else 0
+            )
+            if job["bytes_total"]:
+                info["progress"] = round(job["bytes_done"] / job["bytes_total"], 4)
+            elif job["segments_total"]:
+                info["progress"] = round(job["segments_done"] / job["segments_total"], 4)
+            else:
+                info["progress"] = 1.0 if job["status"] == "done" else 0.0
+            return info
+
+    def list(self):
+        return [self.describe(job) for job in sorted(self.jobs.values(), key=lambda j: j["created_at"])]
+
+    def get(self, job_id):
+        job = self.jobs.get(job_id)
+        return self.describe(job) if job else None
+
+    # --- workers ---
+
+    def _run(self, job):
+        if job["status"] != "queued":
+            return
+        try:
+            self._update(job, started_at=time.time(), session_bytes=0, finished_at=None)
+            if not job["url"]:
+                self._set_status(job, "resolving")
+                link = resolver.resolve_episode(
+                    job["anime_id"], job["episode"], job["mode"], job["quality"]
+                )
+                if link is None:
+                    raise ValueError("No usable source found")
+                kind = "m3u8" if link["m3u8"] or ".m3u8" in link["url"] else "mp4"
+                extension = "ts" if kind == "m3u8" else "mp4"
+                self._update(
+                    job,
+                    url=link["url"],
+                    referer=link["referer"] or resolver.ALLANIME_REFR,
+                    kind=kind,
+                    filename=f"{job['name']}.{extension}",
+                )
+            self._set_status(job, "downloading")
+            if job["kind"] == "m3u8":
+                self._download_m3u8(job)
+            else:
+                self._download_mp4(job)
+            self._set_status(job, "done", finished_at=time.time())
+        except Cancelled:
+            self._update(job, status="cancelled", finished_at=job["finished_at"] or time.time())
+        except Exception as e:
+            # Anything else, a malformed resolver result included, fails the
+            # job; left in an ACTIVE status it would be retried on every start
+            with self._lock:
+                if self._cancel[job["id"]].is_set():
+                    job.update(status="cancelled", finished_at=job["finished_at"] or time.time())
+                else:
+                    job.update(status="failed", error=str(e) or repr(e), finished_at=time.time())
+            self._save()
+
+    def _headers(self, job, extra=None):
+        headers = {"User-Agent": resolver.AGENT, "Referer": job["referer"]}
+        headers.update(extra or {})
+        return headers
+
+    def _get(self, job, url, **kwargs):
+        """
+        A response whose session stays out of the pool until it is closed,
+        so no other part reuses the connection a streamed body still holds.
+        """
+        session = self._pool.acquire()
+        try:
+            res = session.get(
+                url,
+                timeout=(upstream.CONNECT_TIMEOUT, upstream.READ_TIMEOUT),
+                **kwargs,
+            )
+        except BaseException:
+            self._pool.release(session)
+            raise
+        close = res.close
+        released = threading.Lock()
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                if released.acquire(blocking=False):
+                    self._pool.release(session)
+
+        res.close = close_and_release
+        return res
+
+    def _stream_to(self, job, response, f):
+        for chunk in response.iter_content(CHUNK_SIZE):
+            self._check_cancel(job)
+            f.write(chunk)
+            self._add_bytes(job, len(chunk))
+
+    def _probe(self, job):
+        """Returns (size, accepts_ranges) for an MP4 source."""
+        res = self._get(job, job["url"], headers=self._headers(job, {"Range": "bytes=0-0"}), stream=True)
+        with res:
+            res.raise_for_status()
+            content_range = res.headers.get("Content-Range", "")
+            if res.status_code == 206 and "/" in content_range:
+                total = content_range.rsplit("/", 1)[1]
+                if total.isdigit():
+                    return int(total), True
+            length = res.headers.get("Content-Length")
+            return (int(length) if length and length.isdigit() else None), False
+
+    def _download_mp4(self, job):
+        final_path = os.path.join(self.folder, job["filename"])
+        size, ranged = self._probe(job)
+        if not ranged or not size:
+            with open(final_path, "wb") as f:
+                self._update(job, bytes_total=size, bytes_done=0)
+                with self._get(job, job["url"], headers=self._headers(job), stream=True) as res:
+                    res.raise_for_status()
+                    self._stream_to(job, res, f)
+            return
+
+        part_size = max(MIN_PART_SIZE, -(-size // self.connections))
+        parts = [
+            (i, start, min(start + part_size, size) - 1)
+            for i, start in enumerate(range(0, size, part_size))
+        ]
+        part_paths = [f"{final_path}.part{i}" for i, _start, _end in parts]
+        done = sum(os.path.getsize(p) for p in part_paths if os.path.exists(p))
+        self._update(job, bytes_total=size, bytes_done=done)
+
+        futures = [
+            self._parts_executor.submit(self._download_range, job, path, start, end)
+            for path, (_i, start, end) in zip(part_paths, parts)
+        ]
+        for future in futures:
+            future.result()
+
+        with open(final_path, "wb") as out:
+            for path in part_paths:
+                with open(path, "rb") as part:
+                    while True:
+                        block = part.read(CHUNK_SIZE)
+                        if not block:
+                            break
+                        out.write(block)
+        for path in part_paths:
+            os.remove(path)
+
+    def _download_range(self, job, path, start, end):
+        have = os.path.getsize(path) if os.path.exists(path) else 0
+        if start + have > end:
+            return
+        headers = self._headers(job, {"Range": f"bytes={start + have}-{end}"})
+        with self._get(job, job["url"], headers=headers, stream=True) as res:
+            res.raise_for_status()
+            if res.status_code != 206:
+                raise ValueError("Source stopped honouring range requests")
+            with open(path, "ab") as f:
+                self._stream_to(job, res, f)
+
+    def _segment_urls(self, job):
+        with self._get(job, job["url"], headers=self._headers(job)) as res:
+            res.raise_for_status()
+            lines = res.text.splitlines()
+        if any(line.startswith("#EXT-X-STREAM-INF") for line in lines):
+            # A master playlist: take the first (best ranked) variant
+            variant = next((l.strip() for l in lines if l.strip() and not l.startswith("#")), None)
+            if variant is None:
+                raise ValueError("Master playlist lists no variant")
+            self._update(job, url=urllib.parse.urljoin(res.url, variant))
+            return self._segment_urls(job)
+        if any(line.startswith("#EXT-X-KEY") and "METHOD=NONE" not in line for line in lines):
+            raise ValueError("Encrypted HLS streams are not supported")
+        return [
+            urllib.parse.urljoin(res.url, line.strip())
+            for line in lines
+            if line.strip() and not line.startswith("#")
+        ]
+
+    def _download_m3u8(self, job):
+        final_path = os.path.join(self.folder, job["filename"])
+        segment_dir = f"{final_path}.segments"
+        os.makedirs(segment_dir, exist_ok=True)
+        urls = self._segment_urls(job)
+        paths = [os.path.join(segment_dir, f"{i:05d}.ts") for i in range(len(urls))]
+        done = sum(1 for p in paths if os.path.exists(p))
+        self._update(job, segments_total=len(urls), segments_done=done)
+
+        futures = [
+            self._parts_executor.submit(self._download_segment, job, url, path)
+            for url, path in zip(urls, paths)
+            if not os.path.exists(path)
+        ]
+        for future in futures:
+            future.result()
+
+        with open(final_path, "wb") as out:
+            for path in paths:
+                with open(path, "rb") as segment:
+                    out.write(segment.read())
+        for path in paths:
+            os.remove(path)
+        os.rmdir(segment_dir)
+
+    def _download_segment(self, job, url, path):
+        self._check_cancel(job)
+        tmp_path = path + ".tmp"
+        with self._get(job, url, headers=self._headers(job), stream=True) as res:
+            res.raise_for_status()
+            with open(tmp_path, "wb") as f:
+                self._stream_to(job, res, f)
+        # Only complete segments get their final name, so resume can trust them
+        os.replace(tmp_path, path)
+        with self._lock:
+            job["segments_done"] += 1
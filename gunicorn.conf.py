@@ -0,0 +1,34 @@
+# gunicorn settings for production: gunicorn -c gunicorn.conf.py wsgi:app
+import os
+import signal
+import threading
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+workers = int(os.environ.get("ANI_WORKERS", str(min(os.cpu_count() or 1, 4))))
+threads = int(os.environ.get("ANI_THREADS", "8"))
+worker_class = "gthread"
+# Import the app once in the master; workers share its memory copy-on-write
+preload_app = True
+keepalive = 5
+timeout = 60
+# Seconds readiness fails before a worker stops accepting connections
+drain_delay = float(os.environ.get("ANI_DRAIN_DELAY", "5"))
+graceful_timeout = int(drain_delay + float(os.environ.get("ANI_GRACEFUL_TIMEOUT", "30")))
+accesslog = os.environ.get("ANI_ACCESS_LOG") or None
+
+# One upstream session per request thread (see upstream.POOL_SIZE)
+os.environ.setdefault("ANI_UPSTREAM_POOL_SIZE", str(threads))
+
+
+def post_worker_init(worker):
+    import serving
+
+    serving.start_warm_up()
+
+    # SIGTERM: fail /readyz first, then let gunicorn finish in-flight
+    # requests and exit within graceful_timeout
+    def drain(sig, frame):
+        serving.begin_drain()
+        threading.Timer(drain_delay, worker.handle_exit, (sig, frame)).start()
+
+    signal.signal(signal.SIGTERM, drain)
@@ -0,0 +1,169 @@
+"""
+Watch history and playback progress, one row per user and show.
+
+Replaces ani-cli's ani-hsts TSV file, which is rewritten with sed on every
+episode. Import an existing file with:
+    python history.py import ~/.local/state/ani-cli/ani-hsts --user me
+"""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+import sqlite_local
+
+# --- Configuration ---
+HISTORY_DB_PATH = os.environ.get("ANI_HISTORY_DB", "watch_history.db")
+DEFAULT_USER = "local"
+
+# ani-cli stores titles as "Name (12 episodes)"
+EPISODE_COUNT = re.compile(r"\s*\(\d+ episodes\)\s*$")
+
+
+def episode_key(ep):
+    try:
+        return (0, float(ep), "")
+    except (TypeError, ValueError):
+        return (1, 0.0, str(ep))
+
+
+def next_episode(available, watched):
+    """The episode after watched in the available list, or None."""
+    later = [ep for ep in available if episode_key(ep) > episode_key(watched)]
+    return min(later, key=episode_key) if later else None
+
+
+class HistoryStore:
+    """SQLite history indexed by user and show, safe across threads and workers."""
+
+    def __init__(self, path=HISTORY_DB_PATH):
+        self.path = path
+        self._connections = sqlite_local.LocalConnections(path, row_factory=sqlite3.Row)
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS history (
+                user TEXT NOT NULL,
+                anime_id TEXT NOT NULL,
+                title TEXT NOT NULL DEFAULT '',
+                episode TEXT NOT NULL,
+                lang TEXT NOT NULL DEFAULT 'sub',
+                position REAL,
+                duration REAL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (user, anime_id)
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS history_recent ON history (user, updated DESC)"
+        )
+
+    def _connect(self):
+        return self._connections.get()
+
+    def record(self, user, anime_id, episode, title=None, lang="sub", position=None,
+               duration=None, updated=None):
+        """Upserts the user's latest episode of a show; a missing title keeps the old one."""
+        self._connect().execute(
+            """
+            INSERT INTO history (user, anime_id, title, episode, lang, position, duration, updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user, anime_id) DO UPDATE SET
+                title = CASE WHEN excluded.title != '' THEN excluded.title ELSE title END,
+                episode = excluded.episode,
+                lang = excluded.lang,
+                position = excluded.position,
+                duration = excluded.duration,
+                updated = excluded.updated
+            """,
+            (user, anime_id, title or "", str(episode), lang, position, duration,
+             updated or time.time()),
+        )
+
+    def entries(self, user, limit=100):
+        rows = self._connect().execute(
+            "SELECT * FROM history WHERE user = ? ORDER BY updated DESC LIMIT ?",
+            (user, limit),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, user, anime_id):
+        row = self._connect().execute(
+            "SELECT * FROM history WHERE user = ? AND anime_id = ?", (user, anime_id)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def anime_ids(self):
+        """Every show anyone has watched."""
+        rows = self._connect().execute("SELECT DISTINCT anime_id FROM history").fetchall()
+        return [row[0] for row in rows]
+
+    def delete(self, user, anime_id=None):
+        if anime_id is None:
+            cursor = self._connect().execute("DELETE FROM history WHERE user = ?", (user,))
+        else:
+            cursor = self._connect().execute(
+                "DELETE FROM history WHERE user = ? AND anime_id = ?", (user, anime_id)
+            )
+        return cursor.rowcount
+
+    def import_hsts(self, lines, user=DEFAULT_USER):
+        """
+        Imports ani-cli history lines ("episode<TAB>id<TAB>title"). Lines
+        are in file order, so later ones win. Returns the number imported.
+        """
+        imported = 0
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            for line in lines:
+                parts = line.rstrip("\r\n").split("\t", 2)
+                if len(parts) < 2 or not parts[0] or not parts[1]:
+                    continue
+                episode, anime_id = parts[0], parts[1]
+                title = EPISODE_COUNT.sub("", parts[2]) if len(parts) > 2 else ""
+                # Keep the file's order in updated so the newest line sorts first
+                self.record(user, anime_id, episode, title, updated=now + imported * 1e-3)
+                imported += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return imported
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def store():
+    """The shared store, opened on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = HistoryStore()
+        return _store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Watch history tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="import an ani-cli ani-hsts file")
+    imp.add_argument("path")
+    imp.add_argument("--user", default=DEFAULT_USER)
+    args = parser.parse_args(argv)
+
+    with open(args.path, encoding="utf-8") as f:
+        count = store().import_hsts(f, user=args.user)
+    print(f"imported {count} shows into {HISTORY_DB_PATH} for {args.user}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+import gzip
+import hashlib
+import os
+
+from flask import request
+
+import cache
+import telemetry  # noqa: F401  its hooks must run first so short-circuited 304s are measured
+from flask_app import app
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# --- Configuration ---
+# Bodies below this aren't worth the CPU or the Content-Encoding overhead
+COMPRESS_MIN_BYTES = int(os.environ.get("ANI_COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE = {"application/json", "text/html", "text/plain", "text/css", "application/javascript"}
+
+# Cache-Control per route rule; routes not listed get no policy and no ETag
+POLICIES = {
+    "/manifest.json": "public, max-age=86400",
+    "/catalog/<type_>/<id>.json": "public, max-age=600, stale-while-revalidate=3600",
+    "/catalog/<type_>/<id>/<extra>.json": "public, max-age=600, stale-while-revalidate=3600",
+    "/meta/<type_>/<id>.json": "public, max-age=3600, stale-while-revalidate=21600",
+    # Stream links are resolved per episode and expire upstream
+    "/stream/<type_>/<id>.json": "public, max-age=300",
+    "/anime/<anime_id>": "public, max-age=3600, stale-while-revalidate=21600",
+    "/api/search": "public, max-age=600",
+    "/search": "public, max-age=600",
+}
+
+# A view sets this on an error or empty fallback; such a response gets no
+# policy and no ETag, so neither clients nor the revalidation hook keep it
+NO_STORE = "no-store"
+
+# full path -> (ETag last sent for it, whether the body was compressible),
+# kept for the route's max-age
+etags = cache.create("etags", ttl=600)
+
+
+def max_age(policy):
+    for part in policy.split(","):
+        name, _sep, value = part.strip().partition("=")
+        if name == "max-age":
+            return int(value)
+    return 0
+
+
+def policy_for_request():
+    if request.method not in ("GET", "HEAD") or request.url_rule is None:
+        return None
+    return POLICIES.get(request.url_rule.rule)
+
+
+def choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def body_tag(body):
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+def variant_tag(tag, encoding):
+    # A strong ETag names exact bytes, so each encoding gets its own
+    return f"{tag}-{encoding}" if encoding else tag
+
+
+def uncached(body, status=200):
+    """A view result for a fallback answer that must not be cached."""
+    return body, status, {"Cache-Control": NO_STORE}
+
+
+def remember(full_path, tag, compressible, policy):
+    etags.set(full_path, (tag, compressible), ttl=max_age(policy))
+
+
+def remembered_tag(full_path, encoding):
+    """The ETag the last body for full_path would carry in this encoding."""
+    entry = etags.get(full_path)
+    if entry is None:
+        return None
+    tag, compressible = entry
+    # Small bodies are sent identity-encoded whatever the client accepts
+    return variant_tag(tag, encoding if compressible else None)
+
+
+@app.before_request
+def _answer_not_modified():
+    """Answers a revalidation from the remembered ETag, before the view runs."""
+    policy = policy_for_request()
+    if policy is None or not request.if_none_match:
+        return None
+    tag = remembered_tag(request.full_path, choose_encoding())
+    if tag is None:
+        return None
+    if request.if_none_match.contains(tag):
+        response = app.response_class(status=304)
+        response.set_etag(tag)
+        response.headers["Cache-Control"] = policy
+        response.vary.add("Accept-Encoding")
+        return response
+    return None
+
+
+@app.after_request
+def _cache_and_compress(response):
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    policy = policy_for_request()
+    body = response.get_data()
+    compressible = response.mimetype in COMPRESSIBLE and len(body) >= COMPRESS_MIN_BYTES
+    encoding = choose_encoding() if compressible else None
+
+    if policy is not None and response.headers.get("Cache-Control") != NO_STORE:
+        tag = body_tag(body)
+        remember(request.full_path, tag, compressible, policy)
+        response.headers["Cache-Control"] = policy
+        response.set_etag(variant_tag(tag, encoding))
+        response.vary.add("Accept-Encoding")
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+
+    if encoding is not None:
+        response.set_data(compress(body, encoding))
+        response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+    return response
@@ -0,0 +1,173 @@
+import bisect
+import threading
+
+# Seconds; covers cached hits through slow provider fan-outs
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+FANOUT_BUCKETS = (1, 2, 4, 8, 16, 32)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{v}"' for n, v in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_labels(self.label_names, key)} {_number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, (list(e[0]), e[1], e[2])) for key, e in self._values.items())
+        for key, (counts, count, total) in items:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                labels = _labels(self.label_names, key, [("le", _number(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels(self.label_names, key, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+
+registry = []
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in list(registry):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+http_seconds = Histogram(
+    "ani_http_request_duration_seconds",
+    "Time spent serving a request, per route.",
+    ("route", "method", "status"),
+)
+http_in_flight = Gauge(
+    "ani_http_requests_in_flight", "Requests currently being served, per route.", ("route",)
+)
+upstream_seconds = Histogram(
+    "ani_upstream_request_duration_seconds",
+    "Time per upstream attempt, per operation and host.",
+    ("operation", "host"),
+)
+upstream_responses = Counter(
+    "ani_upstream_responses_total",
+    "Upstream attempts by operation, host and status (error for no response).",
+    ("operation", "host", "status"),
+)
+upstream_in_flight = Gauge(
+    "ani_upstream_requests_in_flight", "Upstream attempts in progress, per operation.", ("operation",)
+)
+provider_fanout = Histogram(
+    "ani_provider_fanout_width",
+    "Provider endpoints fetched concurrently for one episode.",
+    buckets=FANOUT_BUCKETS,
+)
+client_rejections = Counter(
+    "ani_client_rejections_total", "Requests answered 429 by the per-client rate limit."
+)
+upstream_admissions = Counter(
+    "ani_upstream_admissions_total",
+    "Upstream budget decisions per lane: admitted, queued, rejected or timed_out.",
+    ("lane", "outcome"),
+)
+upstream_queue_seconds = Histogram(
+    "ani_upstream_queue_wait_seconds",
+    "Time upstream calls spent queued for the budget, per lane.",
+    ("lane",),
+)
+breaker_state = Gauge(
+    "ani_circuit_breaker_state",
+    "Circuit breaker state per upstream host: 0 closed, 1 half open, 2 open.",
+    ("host",),
+)
+breaker_events = Counter(
+    "ani_circuit_breaker_events_total",
+    "Circuit breaker openings and calls rejected while open, per host.",
+    ("host", "event"),
+)
+hedges = Counter(
+    "ani_upstream_hedges_total",
+    "Hedged second attempts per operation, and how many of them won.",
+    ("operation", "outcome"),
+)
@@ -0,0 +1,116 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import cache
+import upstream
+
+OMDB_URL = "https://www.omdbapi.com/"
+PLACEHOLDER = "/static/no-image.png"
+
+# --- Configuration ---
+OMDB_API_KEY = os.environ.get("ANI_OMDB_KEY", "bf007c6a")
+# Lookups running at once; OMDb rate-limits bursts
+ENRICH_WORKERS = int(os.environ.get("ANI_ENRICH_WORKERS", "6"))
+# Artwork rarely changes; a miss is retried sooner in case OMDb gains the title
+FOUND_TTL = 30 * 24 * 3600
+MISSING_TTL = 24 * 3600
+# Artwork outlives restarts so OMDb isn't asked again for every show;
+# set ANI_ARTWORK_DB empty to keep it in memory (or the shared ANI_CACHE_DB)
+ARTWORK_DB_PATH = os.environ.get("ANI_ARTWORK_DB", "artwork_cache.db")
+
+# _id -> {"poster", "year", "plot", "genres"}; poster is None when OMDb has none
+artwork_cache = cache.create("artwork", ttl=FOUND_TTL, disk_path=ARTWORK_DB_PATH)
+enrich_executor = ThreadPoolExecutor(max_workers=ENRICH_WORKERS, thread_name_prefix="enrich")
+
+
+class Enricher:
+    """
+    Looks up artwork and metadata for shows on a bounded pool and keeps the
+    results in the persistent artwork cache. Callers never wait on OMDb:
+    decorate() answers from the cache and queues whatever is missing.
+    """
+
+    def __init__(self, executor=enrich_executor):
+        self.executor = executor
+        self._lock = threading.Lock()
+        self._queued = set()
+        self.counters = {"cached": 0, "queued": 0, "found": 0, "missing": 0, "errors": 0}
+
+    def cached(self, anime_id):
+        return artwork_cache.get(anime_id)
+
+    def decorate(self, shows):
+        """Copies of shows with a poster, cached or placeholder; fills the rest later."""
+        decorated = []
+        missing = []
+        for show in shows:
+            art = self.cached(show.get("_id"))
+            if art is None:
+                missing.append(show)
+            else:
+                self._count("cached")
+            decorated.append(dict(show, poster=(art or {}).get("poster") or PLACEHOLDER))
+        self.fill(missing)
+        return decorated
+
+    def fill(self, shows):
+        if not OMDB_API_KEY:
+            return
+        for show in shows:
+            anime_id = show.get("_id")
+            if not anime_id or not show.get("name"):
+                continue
+            with self._lock:
+                if anime_id in self._queued:
+                    continue
+                self._queued.add(anime_id)
+                self.counters["queued"] += 1
+            self.executor.submit(self._fill_one, anime_id, show["name"])
+
+    def _fill_one(self, anime_id, name):
+        try:
+            art = lookup(name)
+            self._count("found" if art["poster"] else "missing")
+            artwork_cache.set(anime_id, art, ttl=FOUND_TTL if art["poster"] else MISSING_TTL)
+        except (requests.RequestException, upstream.UpstreamError, ValueError):
+            self._count("errors")
+        finally:
+            with self._lock:
+                self._queued.discard(anime_id)
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, in_progress=len(self._queued))
+
+
+def lookup(name):
+    res = upstream.get(
+        OMDB_URL,
+        operation="omdb",
+        params={"t": name, "apikey": OMDB_API_KEY},
+        headers={"User-Agent": upstream.HEADERS["User-Agent"]},
+    )
+    res.raise_for_status()
+    data = res.json()
+
+    def field(key):
+        value = data.get(key)
+        return value if value and value != "N/A" else None
+
+    genres = field("Genre")
+    return {
+        "poster": field("Poster"),
+        "year": field("Year"),
+        "plot": field("Plot"),
+        "genres": [g.strip() for g in genres.split(",")] if genres else [],
+    }
+
+
+enricher = Enricher()
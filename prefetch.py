@@ -0,0 +1,89 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Configuration ---
+# Prefetch work never runs more than PREFETCH_WORKERS jobs at once, so it
+# can't take more than that share of the upstream away from live requests.
+PREFETCH_WORKERS = int(os.environ.get("ANI_PREFETCH_WORKERS", "2"))
+PREFETCH_MAX_PENDING = int(os.environ.get("ANI_PREFETCH_MAX_PENDING", "200"))
+
+
+class Prefetcher:
+    """
+    Runs background warm-up jobs on a small pool. A job can be delayed and can
+    repeat every refresh_every seconds until keep_for seconds have passed.
+    Scheduling a key that is already pending only pushes its keep_for
+    deadline out, so work that keeps being asked for keeps repeating.
+    """
+
+    def __init__(self, workers=PREFETCH_WORKERS, max_pending=PREFETCH_MAX_PENDING):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._heap = []
+        self._pending = {}
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self.counters = {"scheduled": 0, "runs": 0, "refreshes": 0, "dropped": 0, "errors": 0}
+
+    def _start(self):
+        # Started lazily so the thread is created in the serving process
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, daemon=True, name="prefetch-scheduler")
+            self._thread.start()
+
+    def schedule(self, key, fn, delay=0, refresh_every=None, keep_for=0):
+        with self._cond:
+            if key in self._pending:
+                pending_fn, pending_refresh, keep_until = self._pending[key]
+                keep_until = max(keep_until, time.monotonic() + keep_for)
+                self._pending[key] = (pending_fn, pending_refresh, keep_until)
+                return False
+            if len(self._pending) >= self.max_pending:
+                self.counters["dropped"] += 1
+                return False
+            now = time.monotonic()
+            self._pending[key] = (fn, refresh_every, now + keep_for)
+            heapq.heappush(self._heap, (now + delay, next(self._order), key))
+            self.counters["scheduled"] += 1
+            self._start()
+            self._cond.notify()
+        return True
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                _due, _order, key = heapq.heappop(self._heap)
+            self._executor.submit(self._run, key)
+
+    def _run(self, key):
+        with self._cond:
+            fn, refresh_every, keep_until = self._pending[key]
+        try:
+            fn()
+        except Exception:
+            with self._cond:
+                self.counters["errors"] += 1
+        with self._cond:
+            self.counters["runs"] += 1
+            next_run = time.monotonic() + (refresh_every or 0)
+            if refresh_every and next_run < keep_until:
+                self.counters["refreshes"] += 1
+                heapq.heappush(self._heap, (next_run, next(self._order), key))
+                self._cond.notify()
+            else:
+                del self._pending[key]
+
+    def stats(self):
+        with self._cond:
+            return dict(self.counters, pending=len(self._pending))
+
+
+prefetcher = Prefetcher()
@@ -0,0 +1,100 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import Response, request
+
+from flask_app import app
+
+# --- Configuration ---
+# Percentage of requests to profile; 0 keeps the profiler off
+PROFILE_PERCENT = float(os.environ.get("ANI_PROFILE_PERCENT", "0"))
+PROFILE_INTERVAL = float(os.environ.get("ANI_PROFILE_INTERVAL", "0.005"))
+# Distinct stacks kept; the rarest are dropped past this
+MAX_STACKS = 5000
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for a share of requests. A background thread reads
+    the stacks of the threads serving profiled requests every interval and
+    counts them in collapsed form, ready for flamegraph.pl or speedscope.
+    """
+
+    def __init__(self, percent=PROFILE_PERCENT, interval=PROFILE_INTERVAL):
+        self.percent = percent
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._threads = {}  # thread id -> route
+        self._stacks = Counter()
+        self._thread = None
+        self.counters = {"requests": 0, "samples": 0}
+
+    def begin(self, route):
+        if self.percent <= 0 or random.random() * 100 >= self.percent:
+            return False
+        with self._lock:
+            self._threads[threading.get_ident()] = route
+            self.counters["requests"] += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, daemon=True, name="profiler")
+                self._thread.start()
+        return True
+
+    def end(self):
+        with self._lock:
+            self._threads.pop(threading.get_ident(), None)
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                threads = dict(self._threads)
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            for ident, route in threads.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    self._add(route, frame)
+
+    def _add(self, route, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        stack.append(route)
+        key = ";".join(reversed(stack))
+        with self._lock:
+            self._stacks[key] += 1
+            self.counters["samples"] += 1
+            if len(self._stacks) > MAX_STACKS:
+                self._stacks = Counter(dict(self._stacks.most_common(MAX_STACKS // 2)))
+
+    def collapsed(self):
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, percent=self.percent, stacks=len(self._stacks))
+
+
+profiler = SamplingProfiler()
+
+
+@app.route("/debug/profile")
+def profile_dump():
+    """Collapsed stacks collected so far; ?reset=1 clears them after reading."""
+    body = profiler.collapsed()
+    if request.args.get("reset"):
+        profiler.reset()
+    return Response(body, mimetype="text/plain")
@@ -0,0 +1,203 @@
+import hashlib
+import hmac
+import os
+import queue
+import re
+import secrets
+import threading
+import urllib.parse
+
+import requests
+from flask import Response, abort, request, send_file, url_for
+
+import cache
+import segment_cache
+import upstream
+from flask_app import app
+
+# --- Configuration ---
+# Proxy links are signed so the endpoint can't be used as an open relay.
+# Every worker must share the secret, so set it when running more than one.
+PROXY_SECRET = os.environ.get("ANI_PROXY_SECRET") or secrets.token_hex(32)
+CHUNK_SIZE = 64 * 1024
+MAX_PLAYLIST_BYTES = 2 * 1024 * 1024
+MEDIA_POOL_SIZE = int(os.environ.get("ANI_MEDIA_POOL_SIZE", "16"))
+# A viewer that can't get a media session this quickly gets a 503, rather
+# than parking a worker thread until some other stream ends
+MEDIA_POOL_WAIT = float(os.environ.get("ANI_MEDIA_POOL_WAIT", "2"))
+# ani-cli's fallback referrer for allanime hosted media
+DEFAULT_REFERER = "https://allmanga.to"
+
+# Media downloads hold a session for the whole response, so they get their
+# own pool and never starve the API calls in upstream.pool.
+media_pool = upstream.SessionPool(size=MEDIA_POOL_SIZE)
+
+# Referer the provider asked for, keyed by link
+referer_cache = cache.create("referers", ttl=6 * 3600, max_bytes=4 * 1024 * 1024)
+
+FORWARD_REQUEST_HEADERS = ("Range", "If-Range", "If-None-Match", "If-Modified-Since")
+# Playlists are rewritten whole, so they are never fetched partially
+RANGE_HEADERS = ("Range", "If-Range")
+FORWARD_RESPONSE_HEADERS = (
+    "Content-Type",
+    "Content-Length",
+    "Content-Range",
+    "Content-Encoding",
+    "Accept-Ranges",
+    "Last-Modified",
+    "ETag",
+)
+URI_ATTRIBUTE = re.compile(r'URI="([^"]*)"')
+
+
+def remember_referer(url, referer):
+    if url and referer:
+        referer_cache.set(url, referer)
+
+
+def referer_for(url):
+    return referer_cache.get(url) or DEFAULT_REFERER
+
+
+def _sign(url, referer):
+    message = f"{url}\n{referer}".encode()
+    return hmac.new(PROXY_SECRET.encode(), message, hashlib.sha256).hexdigest()[:32]
+
+
+def proxy_url(url, referer=None, external=False):
+    """Returns our signed proxy link for a media or playlist URL."""
+    if referer is None:
+        referer = referer_for(url)
+    return url_for(
+        "proxy_media", u=url, r=referer, s=_sign(url, referer), _external=external
+    )
+
+
+def is_playlist(url, content_type=""):
+    path = urllib.parse.urlsplit(url).path
+    return path.endswith(".m3u8") or "mpegurl" in content_type.lower()
+
+
+def rewrite_playlist(text, base_url, referer, external=False):
+    """Points every variant, segment, key and map URI back through the proxy."""
+
+    def proxied(uri):
+        return proxy_url(urllib.parse.urljoin(base_url, uri), referer, external)
+
+    lines = []
+    segment_urls = []
+    after_extinf = False
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            lines.append(line)
+        elif stripped.startswith("#"):
+            after_extinf = after_extinf or stripped.startswith("#EXTINF")
+            lines.append(URI_ATTRIBUTE.sub(lambda m: f'URI="{proxied(m.group(1))}"', line))
+        else:
+            if after_extinf:
+                segment_urls.append(urllib.parse.urljoin(base_url, stripped))
+                after_extinf = False
+            lines.append(proxied(stripped))
+    if segment_urls:
+        segment_cache.register_playlist(segment_urls, referer)
+    return "\n".join(lines) + "\n"
+
+
+def _upstream_headers(referer, ranged=True):
+    headers = {"User-Agent": upstream.HEADERS["User-Agent"], "Referer": referer}
+    for name in FORWARD_REQUEST_HEADERS:
+        if name in request.headers and (ranged or name not in RANGE_HEADERS):
+            headers[name] = request.headers[name]
+    return headers
+
+
+def _fetch(session, url, referer, ranged):
+    return session.request(
+        request.method,
+        url,
+        headers=_upstream_headers(referer, ranged),
+        stream=True,
+        timeout=(upstream.CONNECT_TIMEOUT, upstream.READ_TIMEOUT),
+    )
+
+
+@app.route("/proxy/media", methods=["GET", "HEAD"])
+def proxy_media():
+    url = request.args.get("u", "")
+    referer = request.args.get("r", "")
+    signature = request.args.get("s", "")
+    if not url.startswith(("http://", "https://")):
+        abort(400)
+    if not hmac.compare_digest(signature, _sign(url, referer)):
+        abort(403)
+
+    if segment_cache.is_segment(url):
+        try:
+            path = segment_cache.open_segment(url, referer)
+            return send_file(path, mimetype="video/mp2t", conditional=True)
+        except (requests.RequestException, OSError):
+            pass  # stream it straight from upstream instead
+
+    try:
+        session = media_pool.acquire(timeout=MEDIA_POOL_WAIT)
+    except queue.Empty:
+        return {"error": "Too many streams in progress"}, 503, {"Retry-After": "5"}
+    res = None
+    released = threading.Lock()
+
+    def finish():
+        # Runs from whichever comes first: the body ending or the response closing
+        if released.acquire(blocking=False):
+            if res is not None:
+                res.close()
+            media_pool.release(session)
+
+    try:
+        res = _fetch(session, url, referer, ranged=not is_playlist(url))
+        content_type = res.headers.get("Content-Type", "")
+        if res.status_code == 206 and is_playlist(url, content_type):
+            # Only the Content-Type gave it away; fetch the whole playlist
+            res.close()
+            res = _fetch(session, url, referer, ranged=False)
+            content_type = res.headers.get("Content-Type", "")
+    except requests.RequestException:
+        finish()
+        return {"error": "Upstream media request failed"}, 502
+
+    if res.status_code == 200 and is_playlist(url, content_type):
+        try:
+            body = res.raw.read(MAX_PLAYLIST_BYTES, decode_content=True)
+        finally:
+            finish()
+        text = rewrite_playlist(
+            body.decode("utf-8", "replace"), res.url, referer, external=True
+        )
+        return Response(text, mimetype="application/vnd.apple.mpegurl")
+
+    headers = {
+        name: res.headers[name] for name in FORWARD_RESPONSE_HEADERS if name in res.headers
+    }
+
+    def generate():
+        try:
+            for chunk in res.raw.stream(CHUNK_SIZE, decode_content=False):
+                yield chunk
+        finally:
+            finish()
+
+    if request.method == "HEAD":
+        finish()
+        return Response(status=res.status_code, headers=headers)
+    response = Response(generate(), status=res.status_code, headers=headers, direct_passthrough=True)
+    # A client that disconnects before the body starts never runs generate()
+    response.call_on_close(finish)
+    return response
+
+
+@app.route("/proxy/stats")
+def proxy_stats():
+    return {
+        "media_pool": media_pool.stats(),
+        "segment_cache": segment_cache.segments.stats(),
+    }
@@ -0,0 +1,244 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import decoder
+import upstream
+
+# In-process port of the scraping half of ani-cli: search_anime,
+# episodes_list, provider_init, generate_link, get_links and select_quality.
+
+AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/121.0"
+ALLANIME_REFR = "https://allmanga.to"
+ALLANIME_BASE = "allanime.day"
+MODE = os.environ.get("ANI_CLI_MODE", "sub")
+QUALITY = os.environ.get("ANI_CLI_QUALITY", "best")
+
+REQUEST_HEADERS = {"Referer": ALLANIME_REFR, "User-Agent": AGENT}
+
+SEARCH_GQL = "query( $search: SearchInput $limit: Int $page: Int $translationType: VaildTranslationTypeEnumType $countryOrigin: VaildCountryOriginEnumType ) { shows( search: $search limit: $limit page: $page translationType: $translationType countryOrigin: $countryOrigin ) { edges { _id name availableEpisodes __typename } }}"
+EPISODES_LIST_GQL = "query ($showId: String!) { show( _id: $showId ) { _id availableEpisodesDetail }}"
+EPISODE_EMBED_GQL = "query ($showId: String!, $translationType: VaildTranslationTypeEnumType!, $episodeString: String!) { episode( showId: $showId translationType: $translationType episodeString: $episodeString ) { episodeString sourceUrls }}"
+
+# generate_link: provider number -> (provider name, sourceName it reads)
+PROVIDERS = {
+    1: ("wixmp", "Default"),  # wixmp(default)(m3u8)(multi) -> (mp4)(multi)
+    2: ("youtube", "Yt-mp4"),  # youtube(mp4)(single)
+    3: ("sharepoint", "S-mp4"),  # sharepoint(mp4)(single)
+    4: ("hianime", "Luf-Mp4"),  # hianime(m3u8)(multi)
+}
+
+provider_executor = ThreadPoolExecutor(max_workers=len(PROVIDERS), thread_name_prefix="resolver")
+
+
+def _graphql(query, variables, operation):
+    response = upstream.graphql(query, variables, operation)
+    if response.status_code != 200:
+        raise upstream.UpstreamError(response.status_code)
+    return response.json().get("data") or {}
+
+
+def search_anime(query, mode=MODE):
+    """Returns the shows matching query that have episodes in the given mode."""
+    variables = {
+        "search": {"allowAdult": False, "allowUnknown": False, "query": query},
+        "limit": 40,
+        "page": 1,
+        "translationType": mode,
+        "countryOrigin": "ALL",
+    }
+    edges = (_graphql(SEARCH_GQL, variables, "search").get("shows") or {}).get("edges", [])
+    anime_list = []
+    for edge in edges:
+        episodes = (edge.get("availableEpisodes") or {}).get(mode) or 0
+        if episodes < 1:
+            continue
+        anime_list.append(
+            {"id": edge["_id"], "title": edge.get("name", "").replace('"', ""), "episodes": episodes}
+        )
+    return anime_list
+
+
+def episodes_list(anime_id, mode=MODE):
+    show = _graphql(EPISODES_LIST_GQL, {"showId": anime_id}, "show").get("show") or {}
+    episodes = (show.get("availableEpisodesDetail") or {}).get(mode, [])
+    return sorted(episodes, key=float)
+
+
+def decode_provider_id(encoded):
+    return decoder.decode(encoded).replace("/clock", "/clock.json")
+
+
+def episode_sources(anime_id, ep_no, mode=MODE):
+    """Maps each sourceName of an episode to its encoded provider id."""
+    variables = {"showId": anime_id, "translationType": mode, "episodeString": str(ep_no)}
+    episode = _graphql(EPISODE_EMBED_GQL, variables, "episode").get("episode") or {}
+    sources = {}
+    for src in episode.get("sourceUrls", []):
+        url = src.get("sourceUrl") or ""
+        if url.startswith("--"):
+            sources.setdefault(src.get("sourceName"), url[2:])
+    return sources
+
+
+def provider_init(sources, source_name):
+    encoded = sources.get(source_name)
+    return decode_provider_id(encoded) if encoded else None
+
+
+def _link(quality, url, provider, referer=None, subtitle=None, m3u8=False):
+    return {
+        "quality": quality,
+        "url": url,
+        "provider": provider,
+        "referer": referer,
+        "subtitle": subtitle,
+        "m3u8": m3u8,
+    }
+
+
+def _find_hls_streams(node):
+    # Same objects ani-cli's sed picks: an hls url with English hardsubs
+    if isinstance(node, dict):
+        if "hls" in str(node.get("format", "")) and node.get("hardsub_lang") == "en-US":
+            yield node.get("url")
+        for value in node.values():
+            yield from _find_hls_streams(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _find_hls_streams(value)
+
+
+def _wixmp_links(link, provider):
+    extract_link = link.replace("repackager.wixmp.com/", "")
+    extract_link = re.sub(r"\.urlset.*", "", extract_link)
+    match = re.search(r"/,([^/]*),/mp4", link)
+    qualities = match.group(1).split(",") if match else []
+    return [
+        _link(q, re.sub(r",[^/]*", q, extract_link), provider)
+        for q in qualities
+    ]
+
+
+def m3u8_variants(master_url, referer=None):
+    """Lists the variant streams of an HLS master playlist, best first."""
+    headers = {"User-Agent": AGENT}
+    if referer:
+        headers["Referer"] = referer
+    try:
+        response = upstream.get(master_url, operation="m3u8", headers=headers)
+    except (requests.RequestException, upstream.UpstreamError):
+        return []
+    playlist = response.text
+    if "EXTM3U" not in playlist:
+        return []
+    relative_link = master_url.rsplit("/", 1)[0] + "/"
+    variants = []
+    lines = playlist.splitlines()
+    for i, line in enumerate(lines):
+        if not line.startswith("#EXT-X-STREAM-INF") or i + 1 >= len(lines):
+            continue
+        resolution = re.search(r"RESOLUTION=\d+x(\d+)", line)
+        quality = f"{resolution.group(1)}p" if resolution else "unknown"
+        uri = lines[i + 1].strip()
+        url = uri if uri.startswith("http") else relative_link + uri
+        variants.append((quality, url))
+    return sort_links(variants, key=lambda v: v[0])
+
+
+def get_links(provider_id, provider=None):
+    """Resolves a decoded provider id into playable links."""
+    try:
+        response = upstream.get(
+            f"https://{ALLANIME_BASE}{provider_id}", headers=REQUEST_HEADERS
+        )
+        data = response.json()
+    except (requests.RequestException, upstream.UpstreamError, ValueError):
+        data = {}
+
+    episode_links = []
+    for item in data.get("links", []):
+        if item.get("link") and item.get("resolutionStr"):
+            episode_links.append((item["resolutionStr"], item["link"], item))
+    for url in _find_hls_streams(data):
+        episode_links.append(("", url, {}))
+
+    links = []
+    wixmp = [e for e in episode_links if "repackager.wixmp.com" in e[1]]
+    master = [e for e in episode_links if "master.m3u8" in e[1]]
+    if wixmp:
+        links = sort_links(_wixmp_links(wixmp[0][1], provider))
+    elif master:
+        master_url, item = master[0][1], master[0][2]
+        m3u8_refr = (item.get("headers") or {}).get("Referer")
+        subtitle = None
+        for sub in item.get("subtitles") or []:
+            if sub.get("lang") == "en" and sub.get("label") == "English":
+                subtitle = sub.get("src")
+                break
+        for quality, url in m3u8_variants(master_url, m3u8_refr):
+            links.append(_link(quality, url, provider, m3u8_refr, subtitle, m3u8=True))
+    else:
+        links = [_link(q, url, provider, m3u8=url.endswith(".m3u8")) for q, url, _ in episode_links]
+
+    if "tools.fast4speed.rsvp" in provider_id:
+        links.append(_link("Yt", provider_id, provider, referer=ALLANIME_REFR))
+    return links
+
+
+def _quality_number(quality):
+    match = re.match(r"\d+", quality or "")
+    return int(match.group()) if match else None
+
+
+def sort_links(links, key=lambda link: link["quality"]):
+    # sort -g -r -s: numeric qualities high to low, the rest after them in order
+    numeric = [link for link in links if _quality_number(key(link)) is not None]
+    other = [link for link in links if _quality_number(key(link)) is None]
+    numeric.sort(key=lambda link: _quality_number(key(link)), reverse=True)
+    return numeric + other
+
+
+def generate_link(sources, provider):
+    name, source_name = PROVIDERS.get(provider, PROVIDERS[4])
+    provider_id = provider_init(sources, source_name)
+    return get_links(provider_id, name) if provider_id else []
+
+
+def get_episode_links(anime_id, ep_no, mode=MODE):
+    """Runs all four providers in parallel and returns every link, best first."""
+    sources = episode_sources(anime_id, ep_no, mode)
+    futures = [provider_executor.submit(generate_link, sources, p) for p in PROVIDERS]
+    links = []
+    for future in futures:
+        links.extend(future.result())
+    return sort_links(links)
+
+
+def select_quality(links, quality=QUALITY, player=""):
+    """Picks one link the way ani-cli does for the given quality and player."""
+    player = player.split(" ")[0]
+    if re.search(r"android|iSH|vlc", player):
+        # m3u8 streams don't get the correct referrer on these players
+        links = [link for link in links if not link["m3u8"]]
+    if re.search(r"android|iSH", player):
+        links = [link for link in links if link["quality"] != "Yt"]
+    if not links:
+        return None
+
+    if quality == "best":
+        result = links[0]
+    elif quality == "worst":
+        numbered = [link for link in links if re.match(r"\d{3,4}", link["quality"] or "")]
+        result = numbered[-1] if numbered else None
+    else:
+        result = next(
+            (link for link in links if quality in f"{link['quality']} >{link['url']}"), None
+        )
+    return result or links[0]
+
+
+def resolve_episode(anime_id, ep_no, mode=MODE, quality=QUALITY, player=""):
+    return select_quality(get_episode_links(anime_id, ep_no, mode), quality, player)
@@ -0,0 +1,228 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import cache
+import singleflight
+import upstream
+
+# --- Configuration ---
+SEGMENT_CACHE_DIR = os.environ.get("ANI_SEGMENT_CACHE_DIR", "segment_cache")
+SEGMENT_CACHE_MAX_BYTES = int(
+    os.environ.get("ANI_SEGMENT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024))
+)
+# How many segments to read ahead after each segment request
+PREFETCH_COUNT = int(os.environ.get("ANI_SEGMENT_PREFETCH", "3"))
+PREFETCH_WORKERS = int(os.environ.get("ANI_SEGMENT_PREFETCH_WORKERS", "4"))
+CHUNK_SIZE = 64 * 1024
+
+segment_pool = upstream.SessionPool(size=PREFETCH_WORKERS * 2)
+prefetch_executor = ThreadPoolExecutor(
+    max_workers=PREFETCH_WORKERS, thread_name_prefix="segment-prefetch"
+)
+
+# segment URL -> (referer, the segments that follow it)
+playlist_cache = cache.create("segments", ttl=6 * 3600, max_bytes=16 * 1024 * 1024)
+
+
+class SegmentCache:
+    """
+    Size-capped LRU of HLS segments on disk, keyed by segment URL.
+    Entries written by a prefetch count as wasted if they are evicted
+    before anyone reads them.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # file name -> [size, prefetched_and_unread]
+        self._bytes = 0
+        self._fetches = singleflight.Group("segments")
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "prefetched": 0,
+            "prefetch_used": 0,
+            "prefetch_wasted": 0,
+            "evictions": 0,
+        }
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        # Pick up segments left by a previous run, oldest first
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+            elif os.path.isfile(path):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name, stat.st_size))
+        for _mtime, name, size in sorted(files):
+            self._entries[name] = [size, False]
+            self._bytes += size
+        self._evict()
+
+    def _name(self, url):
+        return hashlib.sha256(url.encode()).hexdigest() + ".ts"
+
+    def path_for(self, url):
+        return os.path.join(self.directory, self._name(url))
+
+    def get(self, url):
+        """Returns the cached file for url, or None."""
+        name = self._name(url)
+        path = self.path_for(url)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and not os.path.exists(path):
+                # Evicted by another worker process
+                del self._entries[name]
+                self._bytes -= entry[0]
+                entry = None
+            if entry is None and os.path.exists(path):
+                # Written by another worker process
+                entry = self._entries[name] = [os.path.getsize(path), False]
+                self._bytes += entry[0]
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(name)
+            self.counters["hits"] += 1
+            if entry[1]:
+                entry[1] = False
+                self.counters["prefetch_used"] += 1
+        return path
+
+    def mark_read(self, url):
+        with self._lock:
+            entry = self._entries.get(self._name(url))
+            if entry is not None and entry[1]:
+                entry[1] = False
+                self.counters["prefetch_used"] += 1
+
+    def contains(self, url):
+        with self._lock:
+            return self._name(url) in self._entries
+
+    def fetch(self, url, referer, prefetch=False):
+        """Downloads url into the cache and returns its path."""
+        return self._fetches.do(url, lambda: self._download(url, referer, prefetch))
+
+    def _download(self, url, referer, prefetch):
+        path = self.path_for(url)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        headers = {"User-Agent": upstream.HEADERS["User-Agent"], "Referer": referer}
+        size = 0
+        try:
+            with segment_pool.session() as session:
+                with session.get(
+                    url,
+                    headers=headers,
+                    stream=True,
+                    timeout=(upstream.CONNECT_TIMEOUT, upstream.READ_TIMEOUT),
+                ) as res:
+                    res.raise_for_status()
+                    with open(tmp_path, "wb") as f:
+                        for chunk in res.iter_content(CHUNK_SIZE):
+                            f.write(chunk)
+                            size += len(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        name = self._name(url)
+        with self._lock:
+            old = self._entries.pop(name, None)
+            if old is not None:
+                self._bytes -= old[0]
+            self._entries[name] = [size, prefetch]
+            self._bytes += size
+            if prefetch:
+                self.counters["prefetched"] += 1
+        self._evict()
+        return path
+
+    def _evict(self):
+        with self._lock:
+            victims = []
+            while self._bytes > self.max_bytes and self._entries:
+                name, (size, unread) = self._entries.popitem(last=False)
+                self._bytes -= size
+                self.counters["evictions"] += 1
+                if unread:
+                    self.counters["prefetch_wasted"] += 1
+                victims.append(name)
+        for name in victims:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            prefetched = self.counters["prefetched"]
+            return dict(
+                self.counters,
+                entries=len(self._entries),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes,
+                hit_ratio=round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+                prefetch_waste_ratio=round(self.counters["prefetch_wasted"] / prefetched, 4)
+                if prefetched
+                else 0.0,
+            )
+
+
+segments = SegmentCache(SEGMENT_CACHE_DIR, SEGMENT_CACHE_MAX_BYTES)
+
+
+def register_playlist(segment_urls, referer):
+    """Remembers segment order of a media playlist for read-ahead."""
+    for i, url in enumerate(segment_urls):
+        playlist_cache.set(url, [referer, segment_urls[i + 1 : i + 1 + PREFETCH_COUNT]])
+
+
+def is_segment(url):
+    return playlist_cache.get(url) is not None
+
+
+def _prefetch(url, referer):
+    if segments.contains(url):
+        return
+    try:
+        segments.fetch(url, referer, prefetch=True)
+    except (requests.RequestException, OSError):
+        pass
+
+
+def read_ahead(url):
+    entry = playlist_cache.get(url)
+    if entry is None:
+        return
+    referer, upcoming = entry
+    for next_url in upcoming:
+        prefetch_executor.submit(_prefetch, next_url, referer)
+
+
+def open_segment(url, referer):
+    """
+    Returns a local file for a known segment, downloading it on a miss,
+    and schedules the next PREFETCH_COUNT segments.
+    """
+    path = segments.get(url)
+    if path is None:
+        # May join a prefetch that is already downloading this segment
+        path = segments.fetch(url, referer)
+        segments.mark_read(url)
+    read_ahead(url)
+    return path
@@ -0,0 +1,66 @@
+import logging
+import os
+import threading
+import time
+
+from app import fetch_shows, search_shows
+from flask_app import app
+
+# --- Configuration ---
+# Shows from the first listing page whose details are fetched at startup
+WARMUP_SHOWS = int(os.environ.get("ANI_WARMUP_SHOWS", "40"))
+# Paths requested through the app itself so their caches and ETags are primed
+WARMUP_PATHS = ["/manifest.json", "/catalog/anime/allanime.catalog.json"]
+
+log = logging.getLogger("ani.serving")
+
+state = {"status": "starting", "started": time.time(), "warmed_in": None}
+_lock = threading.Lock()
+
+
+def warm_up():
+    """Fills the caches with the popular listing, its shows and the manifest."""
+    start = time.monotonic()
+    try:
+        shows = search_shows("", 1)[:WARMUP_SHOWS]
+        fetch_shows([show["_id"] for show in shows if show.get("_id")])
+        client = app.test_client()
+        for path in WARMUP_PATHS:
+            client.get(path)
+    except Exception:
+        # A cold cache is slower, not broken; serve anyway
+        log.warning("cache warm-up failed", exc_info=True)
+    with _lock:
+        state["warmed_in"] = round(time.monotonic() - start, 3)
+        if state["status"] == "warming":
+            state["status"] = "ready"
+
+
+def start_warm_up():
+    """
+    Warms caches on a background thread; /readyz fails until it is done.
+    Call it in each worker after the fork, never in a preloading master.
+    """
+    with _lock:
+        if state["status"] != "starting":
+            return
+        state["status"] = "warming"
+    threading.Thread(target=warm_up, daemon=True, name="warm-up").start()
+
+
+def begin_drain():
+    """Fails readiness so load balancers stop sending new requests."""
+    with _lock:
+        state["status"] = "draining"
+
+
+@app.route("/healthz")
+def liveness():
+    return {"status": "alive", "pid": os.getpid()}
+
+
+@app.route("/readyz")
+def readiness():
+    with _lock:
+        snapshot = dict(state, pid=os.getpid())
+    return snapshot, 200 if snapshot["status"] == "ready" else 503
@@ -0,0 +1,103 @@
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+# --- Configuration ---
+# Entries older than this are not trusted to answer a search on their own
+INDEX_TTL = int(os.environ.get("ANI_INDEX_TTL", str(6 * 3600)))
+# Share of the query's trigrams a name must contain to count as a match
+MIN_SCORE = 0.5
+# Without a prefix match or one this close, the index doesn't answer alone
+STRONG_SCORE = 0.6
+# Pages of the upstream show listing to crawl in the background (0 = off)
+CRAWL_PAGES = int(os.environ.get("ANI_INDEX_CRAWL_PAGES", "0"))
+CRAWL_INTERVAL = int(os.environ.get("ANI_INDEX_CRAWL_INTERVAL", str(6 * 3600)))
+
+
+def normalize(text):
+    return " ".join(re.sub(r"[^0-9a-z]+", " ", (text or "").lower()).split())
+
+
+def trigrams(text, prefix=False):
+    """
+    Word trigrams padded like pg_trgm. With prefix the last word is left
+    open at the end, so a half-typed word matches every word it starts.
+    """
+    words = normalize(text).split()
+    grams = []
+    for i, word in enumerate(words):
+        padded = f"  {word}" if prefix and i == len(words) - 1 else f"  {word} "
+        grams.extend(padded[j : j + 3] for j in range(len(padded) - 2))
+    return grams
+
+
+class ShowIndex:
+    """In-memory trigram index over show names for local typeahead search."""
+
+    def __init__(self, ttl=INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._shows = {}  # _id -> (show, normalized name, updated)
+        self._postings = defaultdict(set)
+        self.counters = {"local_hits": 0, "upstream_fallbacks": 0}
+
+    def add(self, show, now=None):
+        show_id = show.get("_id")
+        if not show_id:
+            return
+        name = normalize(show.get("name"))
+        with self._lock:
+            old = self._shows.get(show_id)
+            if old is not None:
+                for gram in set(trigrams(old[1])):
+                    self._postings[gram].discard(show_id)
+            self._shows[show_id] = (dict(show), name, now or time.time())
+            for gram in set(trigrams(name)):
+                self._postings[gram].add(show_id)
+
+    def add_many(self, shows):
+        now = time.time()
+        for show in shows:
+            self.add(show, now)
+
+    def search(self, query, limit=40):
+        """
+        Returns (shows, fresh). fresh is False when there is no strong match
+        or any match is older than the TTL; the caller should then ask upstream.
+        """
+        query_grams = set(trigrams(query, prefix=True))
+        if not query_grams:
+            return [], False
+        normalized = normalize(query)
+        with self._lock:
+            hits = Counter()
+            for gram in query_grams:
+                for show_id in self._postings.get(gram, ()):
+                    hits[show_id] += 1
+            scored = []
+            for show_id, count in hits.items():
+                score = count / len(query_grams)
+                if score < MIN_SCORE:
+                    continue
+                show, name, updated = self._shows[show_id]
+                prefix = name.startswith(normalized) or f" {normalized}" in f" {name}"
+                scored.append((-score, not prefix, name, show, updated))
+        scored.sort(key=lambda s: s[:3])
+        top = scored[:limit]
+        cutoff = time.time() - self.ttl
+        strong = any(not s[1] or -s[0] >= STRONG_SCORE for s in top)
+        fresh = strong and all(updated >= cutoff for *_rest, updated in top)
+        return [dict(s[3]) for s in top], fresh
+
+    def record(self, local):
+        with self._lock:
+            self.counters["local_hits" if local else "upstream_fallbacks"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, shows=len(self._shows), trigrams=len(self._postings))
+
+
+index = ShowIndex()
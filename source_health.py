@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+import urllib.parse
+
+import requests
+
+import prefetch
+import proxy
+import upstream
+
+# --- Configuration ---
+PROBE_INTERVAL = int(os.environ.get("ANI_PROBE_INTERVAL", "120"))
+# Stop probing a host once no resolved link has pointed at it for this long
+PROBE_KEEP = int(os.environ.get("ANI_PROBE_KEEP", "3600"))
+PROBE_BYTES = 64 * 1024
+# Weight of the newest sample in the moving averages
+ALPHA = 0.3
+# Below this a host can't keep up with a 1080p stream
+GOOD_THROUGHPUT = 1024 * 1024
+# A host failing this share of its recent probes is unlikely to play at all
+FAILING_ERROR_RATE = 0.5
+
+probe_pool = upstream.SessionPool(size=4)
+
+
+class HostHealth:
+    def __init__(self):
+        self.ttfb = None
+        self.throughput = None
+        self.error_rate = 0.0
+        self.samples = 0
+        self.last_probe = None
+        self.last_status = None
+
+    def _average(self, current, sample):
+        return sample if current is None else ALPHA * sample + (1 - ALPHA) * current
+
+    def record(self, ok, ttfb=None, throughput=None, status=None):
+        self.samples += 1
+        self.last_probe = time.time()
+        self.last_status = status
+        self.error_rate = self._average(
+            self.error_rate if self.samples > 1 else None, 0.0 if ok else 1.0
+        )
+        if ok:
+            self.ttfb = self._average(self.ttfb, ttfb)
+            self.throughput = self._average(self.throughput, throughput)
+
+    def penalty(self):
+        """Extra ranking cost, in priority() classes, for a slow or failing host."""
+        if not self.samples:
+            return 0.0
+        cost = 4 * self.error_rate
+        if self.ttfb is not None:
+            cost += min(self.ttfb, 3.0) / 1.5
+        if self.throughput is not None and self.throughput < GOOD_THROUGHPUT:
+            cost += 1 - self.throughput / GOOD_THROUGHPUT
+        return cost
+
+    def to_dict(self):
+        return {
+            "ttfb_ms": round(self.ttfb * 1000, 1) if self.ttfb is not None else None,
+            "throughput_bps": round(self.throughput) if self.throughput is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "samples": self.samples,
+            "last_probe": self.last_probe,
+            "last_status": self.last_status,
+            "penalty": round(self.penalty(), 3),
+        }
+
+
+class SourceHealth:
+    """
+    Keeps per-host moving averages of time to first byte, throughput and
+    error rate, fed by background Range probes of recently resolved links.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hosts = {}
+        self._samples = {}  # host -> a recent link on that host
+
+    def host(self, url):
+        return urllib.parse.urlsplit(url).hostname or ""
+
+    def observe(self, links):
+        """Registers resolved links and keeps their hosts under probing."""
+        for url in links:
+            host = self.host(url)
+            if not host:
+                continue
+            with self._lock:
+                self._samples[host] = url
+                self.hosts.setdefault(host, HostHealth())
+            prefetch.prefetcher.schedule(
+                ("probe", host),
+                lambda host=host: self.probe(host),
+                refresh_every=PROBE_INTERVAL,
+                keep_for=PROBE_KEEP,
+            )
+
+    def probe(self, host):
+        with self._lock:
+            url = self._samples.get(host)
+        if url is None:
+            return
+        headers = {
+            "User-Agent": upstream.HEADERS["User-Agent"],
+            "Referer": proxy.referer_for(url),
+            "Range": f"bytes=0-{PROBE_BYTES - 1}",
+        }
+        start = time.monotonic()
+        try:
+            with probe_pool.session() as session:
+                with session.get(
+                    url,
+                    headers=headers,
+                    stream=True,
+                    timeout=(upstream.CONNECT_TIMEOUT, upstream.READ_TIMEOUT),
+                ) as res:
+                    ttfb = time.monotonic() - start
+                    received = 0
+                    for chunk in res.iter_content(16 * 1024):
+                        received += len(chunk)
+                        if received >= PROBE_BYTES:
+                            break
+                    elapsed = max(time.monotonic() - start - ttfb, 1e-3)
+                    ok = res.status_code < 400
+                    self.record(host, ok, ttfb, received / elapsed, res.status_code)
+        except requests.RequestException:
+            self.record(host, False)
+
+    def record(self, host, ok, ttfb=None, throughput=None, status=None):
+        with self._lock:
+            self.hosts.setdefault(host, HostHealth()).record(ok, ttfb, throughput, status)
+
+    def score(self, url, base):
+        """Lower is better: the static class from base plus the host penalty."""
+        with self._lock:
+            health = self.hosts.get(self.host(url))
+            penalty = health.penalty() if health else 0.0
+        return base(url) + penalty
+
+    def failing(self, url):
+        with self._lock:
+            health = self.hosts.get(self.host(url))
+            return bool(health and health.samples and health.error_rate >= FAILING_ERROR_RATE)
+
+    def rank(self, links, base):
+        return sorted(links, key=lambda url: self.score(url, base))
+
+    def stats(self):
+        with self._lock:
+            return {host: health.to_dict() for host, health in sorted(self.hosts.items())}
+
+
+monitor = SourceHealth()
@@ -0,0 +1,27 @@
+import os
+import sqlite3
+import threading
+
+
+class LocalConnections:
+    """
+    One autocommit SQLite connection per thread and process for a file.
+    sqlite3 connections can't cross threads or forks, so a store shared by
+    request threads and preforked workers asks this for its connection.
+    """
+
+    def __init__(self, path, row_factory=None):
+        self.path = path
+        self.row_factory = row_factory
+        self._local = threading.local()
+
+    def get(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            if self.row_factory is not None:
+                conn.row_factory = self.row_factory
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
@@ -1,5 +1,17 @@
+import urllib.parse
 from app import *
 
+# How long Stremio and caches in front of us may keep a catalog page
+CATALOG_CACHE_MAX_AGE = 600
+# Stream requests resolve sub and dub together; the dub side runs here
+STREAM_LANGS = ("sub", "dub")
+STREAM_LANG_WORKERS = int(os.environ.get("ANI_STREAM_LANG_WORKERS", "8"))
+LANG_LABELS = {"sub": "Sub", "dub": "Dub"}
+
+stream_lang_executor = ThreadPoolExecutor(
+    max_workers=STREAM_LANG_WORKERS, thread_name_prefix="stream-lang"
+)
+
 
 @app.route("/manifest.json")
 def manifest():
@@ -14,6 +26,11 @@ def manifest():
                 "type": "anime",
                 "id": "allanime.catalog",
                 "name": "AllAnime",
+                "extra": [
+                    {"name": "search", "isRequired": False},
+                    {"name": "skip", "isRequired": False},
+                ],
+                "extraSupported": ["search", "skip"],
             }
         ],
         "resources": [
@@ -24,52 +41,76 @@ def manifest():
         "idPrefixes": ["allanime"]
     }
 
-@app.route("/catalog/<type_>/<id>.json")
-def catalog(type_, id):
-    print("/catalog/<type_>/<id>.json", type_, id)
-    print("args", request.args)
-    print("json", request.json)
+def catalog_page(extra):
+    """(query, upstream page, offset in that page) from the Stremio extras."""
+    # Stremio passes extras in the path, e.g. "search=naruto&skip=40"
+    extras = dict(urllib.parse.parse_qsl(extra))
+    query = extras.get("search", "").strip()
+    try:
+        skip = max(int(extras.get("skip", 0)), 0)
+    except ValueError:
+        skip = 0
+    page, offset = divmod(skip, SEARCH_PAGE_SIZE)
+    return query, page + 1, offset
 
-    query = request.args.get("search", "")
-    shows, _q = get_shows()  # you already have get_shows()
+
+def local_catalog_shows(query, page):
+    """
+    A search page from the local show index, or None when upstream must
+    answer. The index has no notion of upstream's paging, so it only answers
+    when its fresh matches fit in one page, i.e. it holds the whole result.
+    The unfiltered listing is upstream's popularity order and always goes there.
+    """
+    if not query:
+        return None
+    shows, fresh = show_index.index.search(query, limit=SEARCH_PAGE_SIZE)
+    local = fresh and len(shows) < SEARCH_PAGE_SIZE
+    show_index.index.record(local=local)
+    if not local:
+        return None
+    return shows if page == 1 else []
+
+
+def catalog_shows(query, page):
+    shows = local_catalog_shows(query, page)
+    return search_shows(query, page) if shows is None else shows
+
+
+def catalog_body(query, page, offset, shows):
+    # Scrolling usually asks for the next page next, so warm it now
+    if len(shows) >= SEARCH_PAGE_SIZE:
+        prefetch.prefetcher.schedule(
+            ("catalog", query, page + 1), lambda: catalog_shows(query, page + 1)
+        )
 
     metas = []
-    for show in shows:
+    for show in posters.enricher.decorate(shows[offset:]):
         metas.append({
             "id": f"allanime:{show['_id']}",
             "type": "anime",
             "name": show.get("name", "Unknown"),
-            "poster": show.get("poster", "/static/no-image.png"),
+            "poster": show["poster"],
         })
 
-    return {"metas": metas}
+    return {"metas": metas, "cacheMaxAge": CATALOG_CACHE_MAX_AGE}
 
-@app.route("/meta/<type_>/<id>.json")
-def meta(type_, id):
-    print("/meta/<type_>/<id>.json", type_, id)
-    print("args", request.args)
-    print("json", request.json)
-    anime_id = id.replace("allanime:", "")
-    query = """
-    query ($showId: String!) {
-      show(_id: $showId) {
-        _id
-        name
-        availableEpisodesDetail
-      }
-    }
-    """
-    payload = {"query": query, "variables": {"showId": anime_id}}
-    response = requests.post(API_URL, headers=HEADERS, json=payload)
-    data = response.json()
-    show = data.get("data", {}).get("show", {})
+
+def meta_body(anime_id, show):
     episodes = sorted(show.get("availableEpisodesDetail", {}).get("sub", []), key=lambda x: float(x))
 
+    art = posters.enricher.cached(anime_id)
+    if art is None:
+        posters.enricher.fill([show])
+        art = {}
+
     metas = {
         "id": f"allanime:{anime_id}",
         "type": "anime",
         "name": show.get("name", "Unknown Anime"),
-        "poster": "/static/no-image.png",
+        "poster": art.get("poster") or posters.PLACEHOLDER,
+        "description": art.get("plot"),
+        "releaseInfo": art.get("year"),
+        "genres": art.get("genres", []),
         "videos": [
             {
                 "id": f"allanime:{anime_id}:{ep}",
@@ -83,27 +124,112 @@ def meta(type_, id):
 
     return {"meta": metas}
 
+
+def episode_langs(show, ep_number):
+    """Languages show lists the episode in; both when it lists neither."""
+    detail = (show or {}).get("availableEpisodesDetail") or {}
+    langs = [lang for lang in STREAM_LANGS if str(ep_number) in (detail.get(lang) or [])]
+    return langs or list(STREAM_LANGS)
+
+
+def stream_langs(anime_id, ep_number):
+    """Languages the episode is known to exist in; both when the show can't be fetched."""
+    try:
+        show = fetch_show(anime_id)
+    except (requests.RequestException, upstream.UpstreamError, ValueError):
+        show = None
+    return episode_langs(show, ep_number)
+
+
+def resolve_streams(anime_id, ep_number, langs):
+    """{lang: ranked urls}, every language but the first resolved on the side."""
+    def resolve(lang):
+        result = fetch_usable_urls({"anime_id": anime_id, "ep_number": ep_number, "lang": lang})
+        return result.get("urls", []) if isinstance(result, dict) else []
+
+    deadline = time.monotonic() + SOURCE_DEADLINE + 2
+    others = {
+        lang: stream_lang_executor.submit(admission.carry(resolve), lang) for lang in langs[1:]
+    }
+    urls = {langs[0]: resolve(langs[0])}
+    for lang, future in others.items():
+        try:
+            urls[lang] = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except Exception:
+            # Still queued behind busy workers: drop it rather than let it
+            # resolve for a viewer who already has their answer
+            future.cancel()
+            urls[lang] = []
+    return urls
+
+
+def stream_entry(lang, url):
+    quality = link_quality(url)
+    host = source_health.monitor.host(url)
+    hls = proxy.is_playlist(url)
+    kind = "HLS" if hls else "MP4"
+    hints = {"bingeGroup": f"allanime-{lang}-{quality or 'auto'}-{kind.lower()}"}
+    if hls:
+        # Playlists and their segments need the provider's referer on every
+        # request, which only our proxy can add for web and TV players
+        url = proxy.proxy_url(url, external=True)
+        if not url.startswith("https://"):
+            hints["notWebReady"] = True
+    else:
+        hints["notWebReady"] = True
+        hints["proxyHeaders"] = {
+            "request": {"Referer": proxy.referer_for(url), "User-Agent": upstream.HEADERS["User-Agent"]}
+        }
+    return {
+        "name": f"AllAnime\n{quality or 'Auto'}",
+        "title": f"{LANG_LABELS[lang]} | {quality or 'Auto'} | {kind}\n{host}",
+        "url": url,
+        "behaviorHints": hints,
+    }
+
+
+def stream_body(urls_by_lang):
+    """
+    Labelled Stremio streams, most likely to play first: links on hosts
+    whose probes keep failing go last, then sub before dub, then each
+    language's own ranking by quality and host health.
+    """
+    ranked = []
+    for lang_order, lang in enumerate(STREAM_LANGS):
+        for rank, url in enumerate(urls_by_lang.get(lang) or []):
+            ranked.append(((source_health.monitor.failing(url), lang_order, rank), lang, url))
+    ranked.sort(key=lambda item: item[0])
+    return {"streams": [stream_entry(lang, url) for _key, lang, url in ranked]}
+
+
+@app.route("/catalog/<type_>/<id>.json")
+@app.route("/catalog/<type_>/<id>/<extra>.json")
+def catalog(type_, id, extra=""):
+    query, page, offset = catalog_page(extra)
+    try:
+        shows = catalog_shows(query, page)
+    except (requests.RequestException, upstream.UpstreamError):
+        return http_cache.uncached({"metas": []})
+    return catalog_body(query, page, offset, shows)
+
+@app.route("/meta/<type_>/<id>.json")
+def meta(type_, id):
+    anime_id = id.replace("allanime:", "")
+    show = fetch_show(anime_id)
+    body = meta_body(anime_id, show)
+    # Unknown for now; don't let caches keep the empty page
+    return body if show else http_cache.uncached(body)
+
 @app.route("/stream/<type_>/<id>.json")
 def stream(type_, id):
-    print("/stream/<type_>/<id>.json", type_, id)
-    print("args", request.args)
-    print("json", request.json)
     # id looks like "allanime:<anime_id>:<episode_number>"
     parts = id.split(":")
     anime_id = parts[1]
     ep_number = parts[2]
 
-    urls = fetch_usable_urls({
-        "anime_id": anime_id,
-        "ep_number": ep_number,
-        "lang": "sub"
-    }).get("urls", [])
-
-    streams = []
-    for url in urls:
-        streams.append({
-            "title": "AllAnime",
-            "url": url,
-        })
-
-    return {"streams": streams}
+    langs = stream_langs(anime_id, ep_number)
+    urls = resolve_streams(anime_id, ep_number, langs)
+    for lang in langs:
+        prefetch_next_episode(anime_id, ep_number, lang)
+    body = stream_body(urls)
+    return body if body["streams"] else http_cache.uncached(body)
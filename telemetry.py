@@ -0,0 +1,80 @@
+import json
+import logging
+import os
+import random
+import time
+
+from flask import Response, g, request
+
+import metrics
+import profiler
+from flask_app import app
+
+# --- Configuration ---
+# Share of requests written to the request log; errors and slow requests always are
+LOG_SAMPLE_RATE = float(os.environ.get("ANI_LOG_SAMPLE", "0.05"))
+LOG_SLOW_SECONDS = float(os.environ.get("ANI_LOG_SLOW", "2"))
+
+log = logging.getLogger("ani.requests")
+if not log.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(_handler)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+
+
+def route_label():
+    # The rule, not the path, so ids don't explode the label set
+    return request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+
+
+@app.before_request
+def _start_request():
+    g.request_start = time.monotonic()
+    g.route = route_label()
+    metrics.http_in_flight.inc(route=g.route)
+    g.profiled = profiler.profiler.begin(g.route)
+
+
+@app.after_request
+def _record_status(response):
+    g.status = response.status_code
+    return response
+
+
+@app.teardown_request
+def _finish_request(error=None):
+    start = g.pop("request_start", None)
+    if start is None:
+        return
+    elapsed = time.monotonic() - start
+    status = g.pop("status", 500)
+    route = g.pop("route")
+    if g.pop("profiled", False):
+        profiler.profiler.end()
+    metrics.http_in_flight.dec(route=route)
+    metrics.http_seconds.observe(elapsed, route=route, method=request.method, status=status)
+
+    if status >= 500 or elapsed >= LOG_SLOW_SECONDS or random.random() < LOG_SAMPLE_RATE:
+        log.info(
+            json.dumps(
+                {
+                    "ts": round(time.time(), 3),
+                    "method": request.method,
+                    "route": route,
+                    "path": request.path,
+                    "view_args": request.view_args or {},
+                    "args": request.args.to_dict(flat=False),
+                    "status": status,
+                    "ms": round(elapsed * 1000, 2),
+                    "error": repr(error) if error is not None else None,
+                },
+                default=str,
+            )
+        )
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
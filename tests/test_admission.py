@@ -0,0 +1,80 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import admission  # noqa: E402
+
+
+def test_client_limiter_rejects_past_burst():
+    limiter = admission.ClientLimiter(rate=1, burst=2)
+    assert limiter.check("a") == 0
+    assert limiter.check("a") == 0
+    assert limiter.check("a") > 0
+    assert limiter.check("b") == 0
+
+
+def test_queued_interactive_call_goes_before_background():
+    budget = admission.UpstreamBudget(rate=10, burst=1, max_wait=2)
+    budget.acquire("interactive")
+    order = []
+
+    def call(lane):
+        budget.acquire(lane)
+        order.append(lane)
+
+    background = threading.Thread(target=call, args=("background",))
+    background.start()
+    time.sleep(0.02)
+    interactive = threading.Thread(target=call, args=("interactive",))
+    interactive.start()
+    background.join()
+    interactive.join()
+    assert order == ["interactive", "background"]
+    assert budget.stats()["waiting"] == dict.fromkeys(admission.LANES, 0)
+
+
+def test_call_that_would_wait_too_long_is_overloaded():
+    budget = admission.UpstreamBudget(rate=1, burst=1, max_wait=0.05)
+    budget.acquire("browse")
+    with pytest.raises(admission.Overloaded) as error:
+        budget.acquire("browse")
+    assert error.value.retry_after >= 1
+    assert budget.counters["browse"]["timed_out"] == 1
+
+
+def test_full_queue_rejects_at_once():
+    budget = admission.UpstreamBudget(rate=1, burst=1, max_wait=5, max_queue=0)
+    budget.acquire("background")
+    start = time.monotonic()
+    with pytest.raises(admission.Overloaded):
+        budget.acquire("background")
+    assert time.monotonic() - start < 0.5
+    assert budget.counters["background"]["rejected"] == 1
+
+
+def test_async_acquire_waits_for_a_token():
+    budget = admission.UpstreamBudget(rate=20, burst=1, max_wait=2)
+
+    async def main():
+        await budget.acquire_async("interactive")
+        start = time.monotonic()
+        await budget.acquire_async("interactive")
+        return time.monotonic() - start
+
+    assert asyncio.run(main()) >= 0.03
+
+
+def test_carry_keeps_the_callers_lane():
+    seen = []
+    with admission.lane("interactive"):
+        run = admission.carry(lambda: seen.append(admission.current_lane()))
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    assert seen == ["interactive"]
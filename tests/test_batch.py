@@ -0,0 +1,72 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import admission  # noqa: E402
+import batch  # noqa: E402
+
+
+class Recorder:
+    def __init__(self, fail=False):
+        self.batches = []
+        self.lanes = []
+        self.fail = fail
+        self._lock = threading.Lock()
+
+    def __call__(self, keys):
+        with self._lock:
+            self.batches.append(sorted(keys))
+            self.lanes.append(admission.current_lane())
+        if self.fail:
+            raise ValueError("upstream down")
+        return {key: key.upper() for key in keys}
+
+
+def test_keys_within_the_window_share_a_batch():
+    fetch = Recorder()
+    loader = batch.Loader(fetch, max_batch=10, window=0.05)
+    futures = [loader.load(key) for key in ("a", "b", "a", "c")]
+    assert [f.result(timeout=2) for f in futures] == ["A", "B", "A", "C"]
+    assert fetch.batches == [["a", "b", "c"]]
+
+
+def test_full_batches_are_split():
+    fetch = Recorder()
+    loader = batch.Loader(fetch, max_batch=2, window=0.05)
+    assert loader.load_many(list("abcde")) == list("ABCDE")
+    assert sorted(len(keys) for keys in fetch.batches) == [1, 2, 2]
+
+
+def test_batch_error_fails_every_key():
+    loader = batch.Loader(Recorder(fail=True), max_batch=10, window=0.01)
+    futures = [loader.load(key) for key in ("a", "b")]
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(timeout=2)
+
+
+def test_batch_runs_in_the_most_urgent_waiting_lane():
+    fetch = Recorder()
+    loader = batch.Loader(fetch, max_batch=10, window=0.05)
+    with admission.lane("background"):
+        first = loader.load("a")
+    with admission.lane("interactive"):
+        second = loader.load("b")
+    first.result(timeout=2)
+    second.result(timeout=2)
+    assert fetch.lanes == ["interactive"]
+
+
+def test_graphql_errors_fail_the_batch():
+    class Response:
+        status_code = 200
+
+        def json(self):
+            return {"errors": [{"message": "boom"}], "data": None}
+
+    with pytest.raises(batch.upstream.UpstreamError):
+        batch.parse_show_batch(Response(), ["a"])
@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache  # noqa: E402
+
+
+def test_entry_goes_stale_then_missing():
+    store = cache.TTLCache("t", ttl=0.05, stale_ttl=0.1)
+    store.set("k", 1)
+    assert store.lookup("k") == (1, cache.FRESH)
+    time.sleep(0.07)
+    assert store.lookup("k") == (1, cache.STALE)
+    assert store.get("k") is None
+    time.sleep(0.1)
+    assert store.lookup("k") == (None, cache.MISS)
+
+
+def test_stale_entry_is_served_while_refreshed():
+    store = cache.TTLCache("t", ttl=0.05, stale_ttl=10)
+    store.set("k", "old")
+    time.sleep(0.07)
+    assert store.get_or_load("k", lambda: "new") == "old"
+    deadline = time.monotonic() + 2
+    while store.get("k") != "new" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert store.get("k") == "new"
+
+
+def test_least_recently_used_entry_is_evicted():
+    # Each value is 12 bytes of JSON
+    store = cache.TTLCache("t", ttl=60, max_bytes=30)
+    store.set("a", "x" * 10)
+    store.set("b", "x" * 10)
+    store.get("a")
+    store.set("c", "x" * 10)
+    assert store.get("b") is None
+    assert store.get("a") and store.get("c")
+    assert store.counters["evictions"] == 1
+
+
+def test_keep_decides_what_is_stored():
+    store = cache.TTLCache("t", ttl=60)
+    assert store.get_or_load("k", dict, keep=bool) == {}
+    assert store.lookup("k") == (None, cache.MISS)
+    assert store.get_or_load("k", lambda: {"a": 1}, keep=bool) == {"a": 1}
+    assert store.get("k") == {"a": 1}
+
+
+def test_disk_tier_is_shared_between_caches(tmp_path):
+    disk = cache.DiskTier(str(tmp_path / "cache.db"))
+    cache.TTLCache("t", ttl=60, disk=disk).set("k", [1, 2])
+    other = cache.TTLCache("t", ttl=60, disk=disk)
+    assert other.get("k") == [1, 2]
+    assert other.counters["disk_hits"] == 1
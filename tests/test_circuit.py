@@ -0,0 +1,74 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import admission  # noqa: E402
+import circuit  # noqa: E402
+import upstream  # noqa: E402
+
+
+def opened(name, threshold=2):
+    breaker = circuit.CircuitBreaker(name, failure_threshold=threshold, reset_timeout=0)
+    for _ in range(threshold):
+        breaker.failure()
+    return breaker
+
+
+def test_opens_after_consecutive_failures():
+    breaker = circuit.CircuitBreaker("t", failure_threshold=3, reset_timeout=60)
+    breaker.failure()
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == circuit.OPEN
+    assert not breaker.allow()
+    assert breaker.counters["rejected"] == 1
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = opened("t")
+    assert breaker.allow()
+    assert breaker.state == circuit.HALF_OPEN
+    assert not breaker.allow()
+    breaker.success()
+    assert breaker.state == circuit.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_trial_opens_again():
+    breaker = opened("t")
+    breaker.reset_timeout = 60
+    breaker.opened_at -= 60
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == circuit.OPEN
+    assert not breaker.allow()
+
+
+def test_released_trial_can_be_retried():
+    breaker = opened("t")
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_budget_rejection_during_trial_leaves_breaker_usable(monkeypatch):
+    url = "https://budget.test/api"
+    breaker = opened(upstream.breaker_for(url).name)
+    monkeypatch.setitem(upstream.breakers, breaker.name, breaker)
+    monkeypatch.setattr(upstream, "BUDGET_HOSTS", upstream.BUDGET_HOSTS | {breaker.name})
+
+    def overloaded(name=None):
+        raise admission.Overloaded("full", 1)
+
+    monkeypatch.setattr(admission.budget, "acquire", overloaded)
+    with pytest.raises(upstream.OverloadedError):
+        upstream.request("GET", url, "test")
+    assert breaker.state == circuit.HALF_OPEN
+    assert breaker.allow()
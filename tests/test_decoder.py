@@ -0,0 +1,34 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import decoder  # noqa: E402
+from decoder_bench import legacy_decode, sample_ids, shell_table  # noqa: E402
+
+
+def test_table_matches_every_shell_entry():
+    table = shell_table()
+    assert table, "no entries found in ani-cli's provider_init"
+    mismatches = {pair: (char, decoder.decode(pair)) for pair, char in table.items()
+                  if decoder.decode(pair) != char}
+    assert mismatches == {}
+
+
+def test_decode_many_matches_legacy_decoder():
+    table = shell_table()
+    ids = sample_ids(table, count=8, length=120)
+    assert decoder.decode_many(ids) == [legacy_decode(i, table) for i in ids]
+    assert [decoder.decode(i) for i in ids] == [legacy_decode(i, table) for i in ids]
+
+
+def test_decode_many_skips_malformed_ids():
+    table = shell_table()
+    good = sample_ids(table, count=2, length=40)
+    ids = [good[0], "abc", "zz" + good[1][2:], good[1]]
+    assert decoder.decode_many(ids) == [legacy_decode(i, table) for i in good]
+    assert decoder.decode_many([good[0], good[1][:2] + " " + good[1][2:]]) == [
+        legacy_decode(good[0], table)
+    ]
@@ -0,0 +1,63 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import singleflight  # noqa: E402
+
+
+def run_together(group, fn, callers=5):
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(group.do("k", fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_callers_share_one_call():
+    group = singleflight.Group("t")
+    calls = []
+
+    def fn():
+        calls.append(1)
+        time.sleep(0.1)
+        return "value"
+
+    results, errors = run_together(group, fn)
+    assert calls == [1]
+    assert results == ["value"] * 5 and not errors
+    assert group.stats() == {"calls": 1, "shared": 4, "in_flight": 0}
+
+
+def test_error_reaches_every_caller():
+    group = singleflight.Group("t")
+
+    def fn():
+        time.sleep(0.1)
+        raise ValueError("boom")
+
+    results, errors = run_together(group, fn)
+    assert not results
+    assert len(errors) == 5 and all(isinstance(e, ValueError) for e in errors)
+
+
+def test_nothing_is_kept_after_the_call():
+    group = singleflight.Group("t")
+    assert group.do("k", lambda: 1) == 1
+    assert group.do("k", lambda: 2) == 2
+    with pytest.raises(KeyError):
+        group.do("k", lambda: {}["missing"])
+    assert group.do("k", lambda: 3) == 3
@@ -0,0 +1,361 @@
+import os
+import queue
+import random
+import threading
+import time
+import urllib.parse
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import admission
+import circuit
+import metrics
+import singleflight
+
+API_URL = os.environ.get("ANI_API_URL", "https://api.allanime.day/api")
+# Where the decoded /apivtwo/clock provider paths live
+PROVIDER_BASE = os.environ.get("ANI_PROVIDER_BASE", "https://allanime.day")
+
+HEADERS = {
+    "Referer": "https://allanime.to",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/121.0",
+    "Content-Type": "application/json",
+}
+
+# --- Configuration ---
+# One pool per worker process. Every session keeps its own keep-alive
+# connections, so POOL_SIZE should match the number of threads per worker.
+POOL_SIZE = int(os.environ.get("ANI_UPSTREAM_POOL_SIZE", "8"))
+CONNECTIONS_PER_HOST = int(os.environ.get("ANI_UPSTREAM_CONNECTIONS", "4"))
+CONNECT_TIMEOUT = float(os.environ.get("ANI_UPSTREAM_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.environ.get("ANI_UPSTREAM_READ_TIMEOUT", "10"))
+MAX_RETRIES = int(os.environ.get("ANI_UPSTREAM_RETRIES", "2"))
+BACKOFF_BASE = 0.2
+BACKOFF_MAX = 2.0
+
+# Circuit breaker per upstream host
+BREAKER_FAILURES = int(os.environ.get("ANI_BREAKER_FAILURES", "5"))
+BREAKER_RESET = float(os.environ.get("ANI_BREAKER_RESET", "30"))
+# Hedged requests: a second attempt once the first passes the p95 latency
+HEDGE_ENABLED = os.environ.get("ANI_HEDGE", "1") == "1"
+HEDGE_MIN_DELAY = 0.25
+HEDGE_DEFAULT_DELAY = 1.5
+HEDGE_MIN_SAMPLES = 20
+
+# Hosts whose calls draw from the admission budget; others (OMDb, stream
+# hosts) aren't the API we're trying not to get throttled by
+BUDGET_HOSTS = {urllib.parse.urlsplit(url).hostname for url in (API_URL, PROVIDER_BASE)}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class UpstreamError(Exception):
+    def __init__(self, status_code, message=None):
+        super().__init__(message or f"Upstream returned {status_code}")
+        self.status_code = status_code
+
+
+class CircuitOpenError(UpstreamError):
+    def __init__(self, host):
+        super().__init__(503, f"Circuit open for {host}")
+        self.host = host
+
+
+class OverloadedError(UpstreamError):
+    def __init__(self, error):
+        super().__init__(503, str(error))
+        self.retry_after = error.retry_after
+
+
+def _new_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=CONNECTIONS_PER_HOST, pool_maxsize=CONNECTIONS_PER_HOST
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class SessionPool:
+    """A fixed set of keep-alive sessions shared by the threads of one worker."""
+
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.created = 0
+        self.in_use = 0
+        self.waits = 0
+
+    def _reset_after_fork(self):
+        # Sockets must not be shared with the parent after a fork
+        self._idle = queue.LifoQueue()
+        self._pid = os.getpid()
+        self.created = 0
+        self.in_use = 0
+
+    def acquire(self, timeout=None):
+        """A session from the pool; raises queue.Empty if none frees up within timeout."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset_after_fork()
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                session = None
+                if self.created < self.size:
+                    self.created += 1
+                    session = _new_session()
+            if session is not None:
+                self.in_use += 1
+                return session
+            self.waits += 1
+        session = self._idle.get(timeout=timeout)
+        with self._lock:
+            self.in_use += 1
+        return session
+
+    def release(self, session):
+        with self._lock:
+            self.in_use -= 1
+        self._idle.put(session)
+
+    @contextmanager
+    def session(self):
+        session = self.acquire()
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "created": self.created,
+                "in_use": self.in_use,
+                "idle": self._idle.qsize(),
+                "waits": self.waits,
+            }
+
+
+class LatencyStats:
+    """Running call count, error count and latency per upstream operation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ops = {}
+        self._recent = {}
+
+    def record(self, operation, elapsed, error=False):
+        with self._lock:
+            op = self._ops.setdefault(
+                operation,
+                {"count": 0, "errors": 0, "retries": 0, "total": 0.0, "max": 0.0},
+            )
+            op["count"] += 1
+            op["total"] += elapsed
+            op["max"] = max(op["max"], elapsed)
+            if error:
+                op["errors"] += 1
+            else:
+                self._recent.setdefault(operation, deque(maxlen=200)).append(elapsed)
+
+    def p95(self, operation):
+        """p95 of the last successful calls, or None with too few samples."""
+        with self._lock:
+            recent = sorted(self._recent.get(operation, ()))
+        if len(recent) < HEDGE_MIN_SAMPLES:
+            return None
+        return recent[int(len(recent) * 0.95) - 1]
+
+    def record_retry(self, operation):
+        with self._lock:
+            op = self._ops.setdefault(
+                operation,
+                {"count": 0, "errors": 0, "retries": 0, "total": 0.0, "max": 0.0},
+            )
+            op["retries"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for name, op in self._ops.items():
+                result[name] = {
+                    "count": op["count"],
+                    "errors": op["errors"],
+                    "retries": op["retries"],
+                    "avg_ms": round(op["total"] / op["count"] * 1000, 2)
+                    if op["count"]
+                    else 0.0,
+                    "max_ms": round(op["max"] * 1000, 2),
+                }
+        for name in result:
+            p95 = self.p95(name)
+            result[name]["p95_ms"] = round(p95 * 1000, 2) if p95 is not None else None
+        return result
+
+
+pool = SessionPool()
+latency = LatencyStats()
+inflight = singleflight.Group("graphql")
+breakers = {}
+_breakers_lock = threading.Lock()
+hedge_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="hedge")
+hedge_counters = {"hedged": 0, "hedge_wins": 0}
+_hedge_lock = threading.Lock()
+
+
+def breaker_for(url):
+    host = urllib.parse.urlsplit(url).hostname or ""
+    with _breakers_lock:
+        if host not in breakers:
+            breakers[host] = circuit.CircuitBreaker(
+                host, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET
+            )
+        return breakers[host]
+
+
+def count_hedge(operation, outcome):
+    with _hedge_lock:
+        hedge_counters[outcome] += 1
+    metrics.hedges.inc(operation=operation, outcome=outcome)
+
+
+def _backoff(attempt):
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2**attempt))
+    return random.uniform(0, delay)
+
+
+def admit(host):
+    """Waits for the admission budget; OverloadedError if it's spent for too long."""
+    if host not in BUDGET_HOSTS:
+        return
+    try:
+        admission.budget.acquire()
+    except admission.Overloaded as e:
+        admission.note_overload(e)
+        raise OverloadedError(e) from e
+
+
+def _observe(operation, host, elapsed, status):
+    metrics.upstream_in_flight.dec(operation=operation)
+    metrics.upstream_seconds.observe(elapsed, operation=operation, host=host)
+    metrics.upstream_responses.inc(operation=operation, host=host, status=status)
+    latency.record(operation, elapsed, error=status == "error" or status >= 400)
+
+
+def request(method, url, operation, idempotent=None, **kwargs):
+    """
+    Sends a request through the shared session pool.
+    Idempotent calls are retried on connection errors and retryable statuses
+    with bounded exponential backoff. The last response or error is returned
+    or raised to the caller unchanged. While the host's circuit is open the
+    call fails fast with CircuitOpenError. Every attempt to AllAnime first
+    waits its turn in the admission budget.
+    """
+    method = method.upper()
+    if idempotent is None:
+        idempotent = method in IDEMPOTENT_METHODS
+    attempts = 1 + (MAX_RETRIES if idempotent else 0)
+    kwargs.setdefault("headers", HEADERS)
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    breaker = breaker_for(url)
+    host = breaker.name
+
+    for attempt in range(attempts):
+        last_attempt = attempt == attempts - 1
+        if not breaker.allow():
+            raise CircuitOpenError(breaker.name)
+        try:
+            admit(host)
+        except OverloadedError:
+            # Not the host's fault; a half-open trial must not stay taken
+            breaker.release()
+            raise
+        start = time.monotonic()
+        metrics.upstream_in_flight.inc(operation=operation)
+        try:
+            with pool.session() as session:
+                response = session.request(method, url, **kwargs)
+        except requests.RequestException:
+            _observe(operation, host, time.monotonic() - start, "error")
+            breaker.failure()
+            if last_attempt:
+                raise
+        else:
+            _observe(operation, host, time.monotonic() - start, response.status_code)
+            if response.status_code in RETRY_STATUSES:
+                breaker.failure()
+            else:
+                breaker.success()
+            if response.status_code not in RETRY_STATUSES or last_attempt:
+                return response
+            response.close()
+        latency.record_retry(operation)
+        time.sleep(_backoff(attempt))
+
+
+def hedged(operation, fn):
+    """
+    Runs fn, and if it is still running after the operation's p95 latency
+    runs it a second time. Returns whichever attempt succeeds first.
+    """
+    delay = max(latency.p95(operation) or HEDGE_DEFAULT_DELAY, HEDGE_MIN_DELAY)
+    first = hedge_executor.submit(admission.carry(fn))
+    try:
+        return first.result(timeout=delay)
+    except FutureTimeout:
+        pass
+
+    second = hedge_executor.submit(admission.carry(fn))
+    count_hedge(operation, "hedged")
+    pending = {first, second}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is second:
+                    count_hedge(operation, "hedge_wins")
+                return future.result()
+    return first.result()
+
+
+def graphql(query, variables, operation, hedge=False):
+    """
+    Runs a read-only AllAnime GraphQL query; these are safe to retry.
+    Identical queries already in flight share one upstream request.
+    Latency-critical callers can ask for a hedged request.
+    """
+    payload = {"query": query, "variables": variables}
+
+    def call():
+        return request("POST", API_URL, operation, idempotent=True, json=payload)
+
+    if hedge and HEDGE_ENABLED:
+        return inflight.do(
+            singleflight.graphql_key(query, variables), lambda: hedged(operation, call)
+        )
+    return inflight.do(singleflight.graphql_key(query, variables), call)
+
+
+def get(url, operation="provider", **kwargs):
+    return request("GET", url, operation, **kwargs)
+
+
+def stats():
+    return {
+        "pool": pool.stats(),
+        "operations": latency.snapshot(),
+        "coalescing": inflight.stats(),
+        "breakers": {host: b.stats() for host, b in list(breakers.items())},
+        "hedging": dict(hedge_counters),
+    }
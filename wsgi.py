@@ -0,0 +1,5 @@
+# Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+# gunicorn.conf.py starts the cache warm-up in each worker; other servers
+# should call serving.start_warm_up() once per worker process.
+import serving  # noqa: F401  registers /healthz and /readyz
+from stremeo_functions import app  # noqa: F401